@@ -0,0 +1,168 @@
+import os
+import csv
+import numpy as np
+
+import GMR.InputOutput as io
+
+table_name = 'Background_Peaks.csv'
+sidecar_name = 'Background_Peaks.npz'
+tables = {}
+
+
+def reference_names(dir_params, sensor):
+    '''
+    Returns the names of the backgrounds marked as reference lines on an
+    experiment's results figures: the salt and paper standards, the
+    experiment's own solute background, the sensor and the solvents.
+    Args:
+        dir_params: <array> solute_finder output for the experiment directory
+        sensor: <string> name of the photonic crystal used
+    '''
+    return {'1M_Salt_Background',
+            '_'.join(dir_params[0:2]) + '_Background',
+            '1M_Salt_Paper_Background',
+            f'{sensor}_Background',
+            'DI_Background',
+            'IPA_Background'}
+
+
+class BackgroundTable():
+    '''
+    The peak and peak shift of every background of a date, as float arrays
+    in Background_Peaks.csv row order with a dictionary index from
+    background name to row.
+    Args:
+        names: <array> background file names
+        peaks: <array> peak of each background
+        peak_shifts: <array> peak shift of each background from the sensor
+    '''
+    def __init__(self, names=(), peaks=(), peak_shifts=()):
+        self.names = [str(a) for a in names]
+        self.peaks = np.asarray(peaks, dtype=float)
+        self.peak_shifts = np.asarray(peak_shifts, dtype=float)
+        self.index = {}
+        for row, name in enumerate(self.names):
+            self.index.setdefault(name, row)
+
+    def __len__(self):
+        return len(self.names)
+
+    def reference_lines(self, dir_params, sensor):
+        '''
+        Returns the rows, names, peaks and peak shifts of the backgrounds an
+        experiment's results figures mark, in table order, as a list of
+        (row, name, peak, peak shift).
+        Args:
+            dir_params: <array> solute_finder output for the experiment
+                        directory
+            sensor: <string> name of the photonic crystal used
+        '''
+        rows = sorted(self.index[a] for a in reference_names(dir_params,
+                                                             sensor)
+                      if a in self.index)
+        return [(row,
+                 self.names[row],
+                 float(self.peaks[row]),
+                 float(self.peak_shifts[row])) for row in rows]
+
+    @classmethod
+    def from_csv(cls, file):
+        '''
+        Parses a Background_Peaks.csv file (tab delimited name, peak and
+        peak shift) into a BackgroundTable.
+        Args:
+            file: <string> file path
+        '''
+        with open(file, newline='') as infile:
+            rows = [a for a in csv.reader(infile, delimiter='\t') if a]
+        return cls(names=[a[0] for a in rows],
+                   peaks=[float(a[1]) for a in rows],
+                   peak_shifts=[float(a[2]) for a in rows])
+
+    @classmethod
+    def from_sidecar(cls, file, source):
+        '''
+        Loads a BackgroundTable from its binary sidecar, returning None if
+        the sidecar cannot be read or was made from a different version of
+        the csv file.
+        Args:
+            file: <string> sidecar file path
+            source: <array> [size, mtime (ns)] of the csv file
+        '''
+        try:
+            with np.load(file) as data:
+                if list(data['source']) != list(source):
+                    return None
+                return cls(names=data['names'],
+                           peaks=data['peaks'],
+                           peak_shifts=data['peak_shifts'])
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def save_sidecar(self, file, source):
+        '''
+        Saves the table as a binary sidecar (numpy .npz) recording the
+        [size, mtime (ns)] of the csv file it stands in for.
+        Args:
+            file: <string> sidecar file path
+            source: <array> [size, mtime (ns)] of the csv file
+        '''
+        with io.atomic_open(file, 'wb') as outfile:
+            np.savez(outfile,
+                     names=np.array(self.names, dtype=str),
+                     peaks=self.peaks,
+                     peak_shifts=self.peak_shifts,
+                     source=np.array(source, dtype=np.int64))
+
+
+def file_source(file):
+    '''
+    Returns the [size, mtime (ns)] identifying a version of a file.
+    Args:
+        file: <string> file path
+    '''
+    stat = os.stat(file)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def save_table(bg_dir, table):
+    '''
+    Saves the binary sidecar of a date's freshly written
+    Background_Peaks.csv, so it is never parsed as text, and keeps the table
+    for load_table in this process.
+    Args:
+        bg_dir: <string> background directory containing Background_Peaks.csv
+        table: <BackgroundTable> table written to Background_Peaks.csv
+    '''
+    source = file_source(os.path.join(bg_dir, table_name))
+    table.save_sidecar(os.path.join(bg_dir, sidecar_name), source)
+    tables[os.path.abspath(bg_dir)] = (source, table)
+
+
+def load_table(bg_dir):
+    '''
+    Returns the BackgroundTable of a date's Background_Peaks.csv, an empty
+    table if there is none. Tables are kept per process and reused until
+    the csv changes, and are read from the binary sidecar when it matches
+    the csv, which is only parsed (and the sidecar rewritten) otherwise.
+    Args:
+        bg_dir: <string> background directory containing Background_Peaks.csv
+    '''
+    file = os.path.join(bg_dir, table_name)
+    if not os.path.isfile(file):
+        return BackgroundTable()
+    source = file_source(file)
+    key = os.path.abspath(bg_dir)
+    if key in tables and tables[key][0] == source:
+        return tables[key][1]
+
+    sidecar = os.path.join(bg_dir, sidecar_name)
+    table = BackgroundTable.from_sidecar(sidecar, source)
+    if table is None:
+        table = BackgroundTable.from_csv(file)
+        try:
+            table.save_sidecar(sidecar, source)
+        except OSError:
+            pass
+    tables[key] = (source, table)
+    return table
@@ -1,7 +1,12 @@
 import os
+import re
 import numpy as np
 import decimal
 import GMR.InputOutput as io
+import GMR.Profiling as prof
+
+time_stamp_pattern = re.compile(r'_(\d+)_(\d+)h(\d+)m(\d+)s(\d+)$')
+time_stamp_seconds = np.array([24 * 60 * 60, 60 * 60, 60, 1])
 
 def solute_finder(dir_name):
     '''
@@ -43,7 +48,49 @@ def convert_to_seconds(date,
     return float(total_seconds)
 
 
-def time_sort(in_dir_name, dir_params, main_dir):
+def file_time_stamps(file_names):
+    '''
+    Converts the time stamps of a whole list of timed sequence file names
+    (eg.. '1M_Salt_Heat_30_10h05m12s300.csv'), with or without directory
+    and extension, into total seconds. Each name is matched once against
+    time_stamp_pattern and the date, hours, minutes, seconds and
+    milliseconds converted to seconds as one array operation. Returns an
+    array of total seconds, nan for names that do not end in a time stamp.
+    Args:
+        file_names: <array> file names or paths
+    '''
+    matches = [time_stamp_pattern.search(io.get_filename(a))
+               for a in file_names]
+    parts = np.array([a.groups() if a else ('0',) * 5 for a in matches],
+                     dtype=float).reshape(-1, 5)
+    total_seconds = parts[:, 0:4] @ time_stamp_seconds + parts[:, 4] / 1000
+    total_seconds[[a is None for a in matches]] = np.nan
+    return total_seconds
+
+
+def sort_by_time_stamp(file_names):
+    '''
+    Orders timed sequence files by acquisition time rather than by name
+    (where '100' sorts before '20'), using file_time_stamps and a stable
+    argsort. Files whose names have no valid time stamp are reported and
+    left out. Returns the sorted file names and their time stamps in
+    seconds.
+    Args:
+        file_names: <array> file names or paths
+    '''
+    file_names = list(file_names)
+    total_seconds = file_time_stamps(file_names)
+    malformed = np.isnan(total_seconds)
+    for index in np.flatnonzero(malformed):
+        print(f'\n{file_names[index]} skipped, no valid time stamp')
+
+    valid = np.flatnonzero(~malformed)
+    order = valid[np.argsort(total_seconds[valid], kind='stable')]
+    return [file_names[a] for a in order], total_seconds[order]
+
+
+@prof.profiled
+def time_sort(in_dir_name, dir_params, main_dir, cube=False, roi=None):
     '''
     Spectrums/Images captured using splicco's automatic data capture/timed
     sequential function are automatically given a user defined file name and
@@ -53,7 +100,9 @@ def time_sort(in_dir_name, dir_params, main_dir):
     the time stamp at 'h' 'm' and 's' then converting to seconds.
     The function then adds all the values together to give a total time in
     seconds, concatenates this with the original file name, and saves the
-    original data out with a new file name as a numpy array.
+    original data out with a new file name as a numpy array. If cube is True
+    the spectra are instead saved out together as a single spectral cube,
+    written a block at a time with io.CubeWriter.
     Args:
         in_dir_name: <string> directory name containing spectrum files
         dir_params: <array> directories are given a name equivalent to the
@@ -61,33 +110,36 @@ def time_sort(in_dir_name, dir_params, main_dir):
                     the directory name into an array that can be used to find
                     the correct spectrum files.
         main_dir: <string> current working directory
+        cube: <bool> save a spectral cube rather than one file per spectrum
+        roi: <array> [min, max] wavelength (nm) region of interest to keep
     '''
     file_string = '_'.join(dir_params)
     print(f'\n{dir_params}')
     data_files = io.extract_files(dir_name=in_dir_name,
                                   file_string=file_string)
+    data_files, file_seconds = sort_by_time_stamp(data_files)
+
+    out_dir_name = '_'.join(dir_params) + '_TimeAdjusted'
+    out_dir = os.path.join(main_dir, out_dir_name)
+    io.check_dir_exists(out_dir)
 
+    cube_writer = io.CubeWriter(out_dir)
+    progress = io.Progress(total=len(data_files),
+                           label=file_string)
     for index, selected_file in enumerate(data_files):
         file = os.path.join(in_dir_name, selected_file)
-        wavelength, intensity, file_name = io.csv_in(file)
+        wavelength, intensity, file_name = io.csv_in(file, roi=roi)
 
-        data = np.vstack((wavelength, intensity)).T
+        total_seconds = float(file_seconds[index])
 
-        split_file = file_name.split('_')[::-1]
-        date_split = split_file[1]
-        hrs_split = split_file[0].split('h')
-        mins_split = hrs_split[1].split('m')
-        secs_split = mins_split[1].split('s')
+        if cube:
+            cube_writer.write(wavelength=wavelength,
+                              intensity=intensity,
+                              time_stamps=total_seconds)
+            progress.update()
+            continue
 
-        total_seconds = convert_to_seconds(date=date_split,
-                                           hours=hrs_split[0],
-                                           minutes=mins_split[0],
-                                           seconds=secs_split[0],
-                                           milliseconds=secs_split[1])
-
-        out_dir_name = '_'.join(dir_params) + '_TimeAdjusted'
-        out_dir = os.path.join(main_dir, out_dir_name)
-        io.check_dir_exists(out_dir)
+        data = np.vstack((wavelength, intensity)).T
 
         joined = []
         joined.append(file_string)
@@ -98,16 +150,23 @@ def time_sort(in_dir_name, dir_params, main_dir):
                       file_name=new_file_name,
                       dir_name=out_dir)
 
-        io.update_progress(index / len(data_files))
+        progress.update()
+    progress.close()
+
+    if cube:
+        cube_writer.flush()
 
 
-def time_correct(in_dir_name, dir_params, main_dir):
+@prof.profiled
+def time_correct(in_dir_name, dir_params, main_dir, cube=False):
     '''
     Spectrums/Images time adjusted in TimeSort function above are loaded in
     and the data is maintained. The file name is split and the first file
     captured is set to 0, the following files within the directory are given
     a time stamp respective to the zero file (a time step). This is useful
-    for later processing.
+    for later processing. The time adjusted spectra can be individual files
+    or a spectral cube, and are saved out as a spectral cube, written a
+    block at a time with io.CubeWriter, if cube is True.
     Args:
         in_dir_name: <string> directory name containind time adjusted
                      spectrum files
@@ -116,27 +175,61 @@ def time_correct(in_dir_name, dir_params, main_dir):
                     the directory name into an array that can be used to find
                     the correct spectrum files.
         main_dir: <string> current working directory
+        cube: <bool> save a spectral cube rather than one file per spectrum
     '''
     file_string = '_'.join(dir_params[0:2])
     print(' ')
     print(dir_params)
+
+    out_dir_name = '_'.join(dir_params[0:-1]) + '_TimeCorrected'
+    out_dir = os.path.join(main_dir, out_dir_name)
+
+    if io.is_cube(in_dir_name):
+        wavelength, intensity, total_seconds, cube_name = io.cube_in(
+            in_dir_name)
+        time_stamps = (total_seconds - total_seconds.min()).astype(int)
+
+        if cube:
+            io.cube_save(wavelength=wavelength,
+                         intensity=intensity,
+                         time_stamps=time_stamps,
+                         dir_name=out_dir)
+            return
+
+        with io.Progress(total=len(time_stamps),
+                         label=file_string) as progress:
+            for index, time_stamp in enumerate(time_stamps):
+                io.array_save(array_name=np.vstack((wavelength,
+                                                    intensity[index])).T,
+                              file_name=f'{file_string}_{time_stamp}',
+                              dir_name=out_dir)
+                progress.update()
+        return
+
     data_files = io.extract_files(dir_name=in_dir_name,
                                   file_string=file_string)
+    file_seconds = np.array([float(io.get_filename(a).split('_')[-1])
+                             for a in data_files])
+    order = np.argsort(file_seconds, kind='stable')
+    data_files = [data_files[a] for a in order]
+    zero_seconds = file_seconds[order[0]]
 
-    zero_file_name = data_files[0]
-    zero_time_stamp = (zero_file_name.split('_')[::-1])[0]
-
+    cube_writer = io.CubeWriter(out_dir)
+    progress = io.Progress(total=len(data_files),
+                           label=file_string)
     for index, selected_file in enumerate(data_files):
         file = os.path.join(in_dir_name, selected_file)
         data = np.load(file)
 
-        file_name = io.get_filename(file)
-        split_file = file_name.split('_')[::-1]
-        time_correction = int(float(split_file[0])
-                          - float(zero_time_stamp[0:-4]))
+        time_correction = int(file_seconds[order[index]] - zero_seconds)
+
+        if cube:
+            cube_writer.write(wavelength=data[:, 0],
+                              intensity=data[:, 1],
+                              time_stamps=time_correction)
+            progress.update()
+            continue
 
-        out_dir_name = '_'.join(dir_params[0:-1]) + '_TimeCorrected'
-        out_dir = os.path.join(main_dir, out_dir_name)
         io.check_dir_exists(out_dir)
 
         joined = []
@@ -148,7 +241,133 @@ def time_correct(in_dir_name, dir_params, main_dir):
                       file_name=new_file_name,
                       dir_name=out_dir)
 
-        io.update_progress(index / len(data_files))
+        progress.update()
+    progress.close()
+
+    if cube:
+        cube_writer.flush()
+
+
+@prof.profiled
+def ingest(in_dir_name,
+           dir_params,
+           main_dir,
+           save_intermediates=False,
+           dtype=np.float64,
+           data_files=None,
+           zero_seconds=None,
+           roi=None):
+    '''
+    Single pass replacement for time_sort followed by time_correct. Each
+    spectrum file is parsed once, its time stamp converted to seconds and
+    made relative to the first spectrum captured (the zero file), all in
+    memory. The spectra are returned sorted by time as a shared wavelength
+    array and a 2D intensity array (one spectrum per row) ready for peak
+    finding. Files are ordered with sort_by_time_stamp before being read,
+    so any without a valid time stamp are reported and skipped. Returns the
+    time stamps (int seconds), wavelength and intensity.
+    Args:
+        in_dir_name: <string> directory name containing spectrum files
+        dir_params: <array> directories are given a name equivalent to the
+                    individual file names, the dir_params function splits
+                    the directory name into an array that can be used to find
+                    the correct spectrum files.
+        main_dir: <string> current working directory
+        save_intermediates: <bool> if True the time corrected spectra are
+                            also saved out as a spectral cube in the
+                            _TimeCorrected directory
+        dtype: <dtype> data type of the spectra, eg.. np.float32
+        data_files: <array> file names to ingest, defaults to every file in
+                    in_dir_name matching dir_params
+        zero_seconds: <float> time stamp, in seconds, of the zero file if
+                      it is not among data_files (eg.. when adding new
+                      spectra to an earlier run)
+        roi: <array> [min, max] wavelength (nm) region of interest, only
+             this part of each spectrum is parsed, kept and saved
+    '''
+    file_string = '_'.join(dir_params)
+    print(f'\n{dir_params}')
+    if data_files is None:
+        data_files = io.extract_files(dir_name=in_dir_name,
+                                      file_string=file_string)
+    data_files, total_seconds = sort_by_time_stamp(data_files)
+
+    files = [os.path.join(in_dir_name, a) for a in data_files]
+    with io.Progress(total=len(files),
+                     label=file_string) as progress:
+        zero_wavelength, intensity, file_names = io.csv_stack(
+            files=files,
+            dtype=dtype,
+            progress=progress,
+            roi=roi)
+
+    if zero_seconds is None:
+        zero_seconds = total_seconds[0] if len(total_seconds) > 0 else 0
+    time_stamps = (total_seconds - zero_seconds).astype(int)
+
+    if save_intermediates:
+        out_dir_name = file_string + '_TimeCorrected'
+        io.cube_save(wavelength=zero_wavelength,
+                     intensity=intensity,
+                     time_stamps=time_stamps,
+                     dir_name=os.path.join(main_dir, out_dir_name))
+
+    return time_stamps, zero_wavelength, intensity
+
+
+@prof.profiled
+def ingest_cube(in_dir_name,
+                dir_params,
+                main_dir,
+                chunk_size,
+                dtype=np.float64,
+                data_files=None,
+                roi=None):
+    '''
+    Chunked version of ingest for experiments too large to hold in memory.
+    The spectra are read chunk_size at a time, time corrected against the
+    first spectrum captured and written straight into the experiment's
+    _TimeCorrected spectral cube with io.CubeWriter, so only one chunk is
+    ever in memory. Returns the cube directory path, ready for
+    DataProcessing.cube_peak_shift.
+    Args:
+        in_dir_name: <string> directory name containing spectrum files
+        dir_params: <array> solute_finder output for the experiment
+        main_dir: <string> current working directory
+        chunk_size: <int> number of spectra read at once
+        dtype: <dtype> data type of the spectra, eg.. np.float32
+        data_files: <array> file names to ingest, defaults to every file in
+                    in_dir_name matching dir_params
+        roi: <array> [min, max] wavelength (nm) region of interest, only
+             this part of each spectrum is parsed and kept
+    '''
+    file_string = '_'.join(dir_params)
+    print(f'\n{dir_params}')
+    if data_files is None:
+        data_files = io.extract_files(dir_name=in_dir_name,
+                                      file_string=file_string)
+    data_files, total_seconds = sort_by_time_stamp(data_files)
+    if len(data_files) == 0:
+        raise ValueError(f'No spectra to ingest in {in_dir_name}')
+    time_stamps = (total_seconds - total_seconds[0]).astype(int)
+
+    files = [os.path.join(in_dir_name, a) for a in data_files]
+    out_dir = os.path.join(main_dir, file_string + '_TimeCorrected')
+    with io.Progress(total=len(files),
+                     label=file_string) as progress, \
+            io.CubeWriter(out_dir, chunk_rows=chunk_size) as cube_writer:
+        for start in range(0, len(files), chunk_size):
+            wavelength, intensity, file_names = io.csv_stack(
+                files=files[start:start + chunk_size],
+                dtype=dtype,
+                progress=progress,
+                roi=roi)
+            cube_writer.write(wavelength=wavelength,
+                              intensity=intensity,
+                              time_stamps=time_stamps[start:
+                                                      start + chunk_size])
+
+    return out_dir
 
 
 def drange(a, z, jump):
@@ -1,11 +1,22 @@
 import os
-from scipy.signal import find_peaks
+import numpy as np
 
 import GMR.InputOutput as io
 import GMR.DataPreparation as dprep
 import GMR.DataProcessing as dproc
+import GMR.Profiling as prof
 
+peak_parameters = {'distance': 300,
+                   'width': 20,
+                   'peak_window': [730, 810],
+                   'zero_window': [740, 800],
+                   'refinement': None, ## Set to a refinement_methods name ##
+                   'roi': None, ## Set to [min, max] nm to crop spectra ##
+                   'tracking': False} ## Set True to track peaks in time ##
+refinement_methods = ('parabolic', 'centroid', 'gaussian', 'lorentzian')
 
+
+@prof.profiled
 def peaks(x, y, distance, width, xmin, xmax):
     '''
     Utilises the scipy module find_peaks with the possibility to feed in
@@ -23,6 +34,7 @@ def peaks(x, y, distance, width, xmin, xmax):
         xmax: <int> maximum value you expect a peak to occur within the
               x value array, defaults to maxmimum value within x
     '''
+    from scipy.signal import find_peaks
     height = sum(y) / len(y)
     peaks = find_peaks(x=y, height=height, distance=distance, width=width)
     peak_coords = peaks[0]
@@ -34,7 +46,447 @@ def peaks(x, y, distance, width, xmin, xmax):
     return X_array
 
 
-def bg_peaks(file, zero_file):
+@prof.profiled
+def batch_peaks(x, y, distance, width, xmin, xmax, refinement=None):
+    '''
+    Batch version of the peaks function for a whole experiment at once. The
+    spectra are given as a 2D array (one spectrum per row) sharing a single
+    x-axis. Height thresholds and the xmin/xmax window are computed for every
+    row in one go, and rows whose maximum within the window falls below their
+    threshold are skipped as they cannot contain a peak. The remaining rows
+    are passed to find_peaks, which keeps the same distance and width
+    behaviour as the peaks function. Returns an array containing the first
+    peak within the window for each row, nan where no peak was found.
+    With refinement the peaks are refined to sub-sample precision with
+    refine_peaks rather than returned as the x value of the peak sample.
+    Args:
+        x: <array> shared x-axis values such as wavelength, length M
+        y: <array> y-axis values, shape (N, M) for N spectra
+        distance: <int> minimum distance between peaks
+        width: <int> minimum width of peaks
+        xmin: <int> minimum value you expect a peak to occur within the
+              x value array
+        xmax: <int> maximum value you expect a peak to occur within the
+              x value array
+        refinement: <string> refine_peaks method, from refinement_methods,
+                    None for the x value of the peak sample
+    '''
+    x = np.asarray(x, dtype=float)
+    y = np.atleast_2d(y)
+    index, heights = batch_peak_indices(x=x,
+                                        y=y,
+                                        distance=distance,
+                                        width=width,
+                                        window=(x >= xmin) & (x <= xmax))
+    return peak_values(x=x,
+                       y=y,
+                       index=index,
+                       refinement=refinement)
+
+
+def batch_peak_indices(x, y, distance, width, window):
+    '''
+    The find_peaks search of batch_peaks. Returns the sample index of the
+    first peak within window for each row, -1 where no peak was found, and
+    each row's height threshold (its mean).
+    Args:
+        x: <array> shared x-axis values such as wavelength, length M
+        y: <array> y-axis values, shape (N, M) for N spectra
+        distance: <int> minimum distance between peaks
+        width: <int> minimum width of peaks
+        window: <array> boolean mask of the x values a peak may occur at
+    '''
+    from scipy.signal import find_peaks
+    heights = y.mean(axis=1)
+
+    index = np.full(y.shape[0], -1)
+    if window.any():
+        possible = y[:, window].max(axis=1) >= heights
+        for row in np.flatnonzero(possible):
+            peak_coords = find_peaks(x=y[row],
+                                     height=heights[row],
+                                     distance=distance,
+                                     width=width)[0]
+            peak_coords = peak_coords[window[peak_coords]]
+            if peak_coords.size > 0:
+                index[row] = peak_coords[0]
+    return index, heights
+
+
+def peak_values(x, y, index, refinement=None):
+    '''
+    Converts peak sample indices into peak x values, refined with
+    refine_peaks if refinement is given. Returns an array of peak x values,
+    nan where index is -1.
+    Args:
+        x: <array> shared x-axis values such as wavelength, length M
+        y: <array> y-axis values, shape (N, M) for N spectra
+        index: <array> peak sample of each row, -1 where there is no peak
+        refinement: <string> refine_peaks method, None for the peak sample
+    '''
+    if refinement is not None:
+        return refine_peaks(x=x,
+                            y=y,
+                            index=index,
+                            method=refinement)
+    X_array = np.full(y.shape[0], np.nan)
+    found = index >= 0
+    X_array[found] = x[index[found]]
+    return X_array
+
+
+@prof.profiled
+def track_peaks(x,
+                y,
+                distance,
+                width,
+                xmin,
+                xmax,
+                refinement=None,
+                min_window=None,
+                max_window=None):
+    '''
+    Tracking version of batch_peaks for time ordered spectra. Once a peak
+    has been found by the full find_peaks search, each following spectrum is
+    only searched for its maximum within a few samples either side of the
+    previous peak. The window adapts to how far the peak moved last frame,
+    and is doubled (up to max_window) while the maximum sits on its edge.
+    Lock is lost, and the full search used again, when the maximum is still
+    on the edge of the widest window, leaves the xmin/xmax window or falls
+    below the height threshold of the spectrum the lock was found on. The
+    cost per tracked spectrum depends on the window, not the spectrum
+    length, and noisy spectra that find_peaks rejects (on width) keep their
+    peak. Returns an array of the peak of each row, nan where no peak was
+    found.
+    Args:
+        x: <array> shared x-axis values such as wavelength, length M
+        y: <array> y-axis values, shape (N, M) for N spectra in time order
+        distance: <int> minimum distance between peaks for the full search
+        width: <int> minimum width of peaks for the full search
+        xmin: <int> minimum value you expect a peak to occur within the
+              x value array
+        xmax: <int> maximum value you expect a peak to occur within the
+              x value array
+        refinement: <string> refine_peaks method, None for the peak sample
+        min_window: <int> samples searched either side of the previous
+                    peak, defaults to half of width (at least 3)
+        max_window: <int> largest number of samples searched either side,
+                    defaults to 8 times min_window
+    '''
+    x = np.asarray(x, dtype=float)
+    y = np.atleast_2d(y)
+    window = (x >= xmin) & (x <= xmax)
+    index = np.full(y.shape[0], -1)
+    if not window.any():
+        return peak_values(x=x, y=y, index=index)
+    first, last = np.flatnonzero(window)[[0, -1]]
+    if min_window is None:
+        min_window = max(int(width) // 2, 3)
+    if max_window is None:
+        max_window = 8 * min_window
+
+    peak = -1
+    height = None
+    half = min_window
+    for row in range(y.shape[0]):
+        found = -1
+        while peak >= 0:
+            start = max(peak - half, first)
+            stop = min(peak + half, last) + 1
+            local = start + int(np.argmax(y[row, start:stop]))
+            on_edge = ((local == start and start > first)
+                       or (local == stop - 1 and stop - 1 < last))
+            if not on_edge:
+                if first < local < last and y[row, local] >= height:
+                    found = local
+                break
+            if half >= max_window:
+                break
+            half = min(2 * half, max_window)
+
+        if found >= 0:
+            half = int(np.clip(2 * abs(found - peak) + min_window,
+                               min_window,
+                               max_window))
+        else:
+            row_index, heights = batch_peak_indices(x=x,
+                                                    y=y[row:row + 1],
+                                                    distance=distance,
+                                                    width=width,
+                                                    window=window)
+            found = row_index[0]
+            height = heights[0]
+            half = min_window
+        index[row] = found
+        peak = found
+
+    return peak_values(x=x,
+                       y=y,
+                       index=index,
+                       refinement=refinement)
+
+
+def refine_peaks(x, y, index, method='parabolic', half_width=2):
+    '''
+    Refines the peak sample of every spectrum to sub-sample precision with
+    a closed form estimate over the samples around it, all rows at once:
+    'parabolic' fits a parabola through the peak sample and its neighbours,
+    'gaussian' and 'lorentzian' do the same on log(y) and 1/y (exact for
+    those line shapes) and 'centroid' takes the baseline subtracted
+    centre of mass of the half_width samples either side. The position is
+    found in sample space and interpolated onto x, so uneven x spacing is
+    allowed. Peaks on the first or last sample, or where the estimate is not
+    defined (eg.. y <= 0 for the log), are left at the peak sample. Returns
+    an array of refined peak x values, nan where index is -1.
+    Args:
+        x: <array> shared x-axis values such as wavelength, length M
+        y: <array> y-axis values, shape (N, M) for N spectra
+        index: <array> peak sample of each row, -1 where there is no peak
+        method: <string> estimator, from refinement_methods
+        half_width: <int> samples either side of the peak used by centroid
+    '''
+    if method not in refinement_methods:
+        raise ValueError(f'Unknown refinement method {method!r}, '
+                         f'expected one of {refinement_methods}')
+    x = np.asarray(x, dtype=float)
+    y = np.atleast_2d(np.asarray(y, dtype=float))
+    index = np.asarray(index)
+
+    X_array = np.full(y.shape[0], np.nan)
+    rows = np.flatnonzero(index >= 0)
+    centre = index[rows]
+    offset = np.zeros(len(rows))
+
+    if method == 'centroid':
+        samples = np.arange(-half_width, half_width + 1)
+        columns = np.clip(centre[:, None] + samples, 0, y.shape[1] - 1)
+        values = y[rows[:, None], columns]
+        weights = values - values.min(axis=1, keepdims=True)
+        total = weights.sum(axis=1)
+        defined = total > 0
+        offset[defined] = ((weights[defined] * (columns[defined]
+                                                - centre[defined, None]))
+                           .sum(axis=1) / total[defined])
+    else:
+        inner = (centre > 0) & (centre < y.shape[1] - 1)
+        columns = np.clip(centre[:, None] + np.array([-1, 0, 1]),
+                          0, y.shape[1] - 1)
+        values = y[rows[:, None], columns]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if method == 'gaussian':
+                values = np.log(values)
+            elif method == 'lorentzian':
+                values = 1 / values
+            curvature = values[:, 0] - 2 * values[:, 1] + values[:, 2]
+            vertex = 0.5 * (values[:, 0] - values[:, 2]) / curvature
+        defined = inner & np.isfinite(vertex) & (np.abs(vertex) <= 1)
+        offset[defined] = vertex[defined]
+
+    X_array[rows] = np.interp(centre + offset, np.arange(len(x)), x)
+    return X_array
+
+
+@prof.profiled
+def batch_peak_shift(x, y, zero_y):
+    '''
+    Batch version of the peak_shift function. Finds the resonant peak of
+    every spectrum in a 2D intensity array and its shift from the peak of the
+    zero spectrum, all spectra sharing the same wavelength axis, using the
+    module's peak_parameters. Returns two arrays, peak and peak shift, with
+    nan where no peak was found.
+    Args:
+        x: <array> shared wavelength array, length M
+        y: <array> intensity array, shape (N, M) for N spectra
+        zero_y: <array> intensity of the zero (sensor) spectrum, length M
+    '''
+    if peak_parameters['tracking']:
+        find = track_peaks
+    else:
+        find = batch_peaks
+    peak = find(x=x,
+                y=y,
+                distance=peak_parameters['distance'],
+                width=peak_parameters['width'],
+                xmin=peak_parameters['peak_window'][0],
+                xmax=peak_parameters['peak_window'][1],
+                refinement=peak_parameters['refinement'])
+
+    zero_peak = batch_peaks(x=x,
+                            y=zero_y,
+                            distance=peak_parameters['distance'],
+                            width=peak_parameters['width'],
+                            xmin=peak_parameters['zero_window'][0],
+                            xmax=peak_parameters['zero_window'][1],
+                            refinement=peak_parameters['refinement'])
+
+    peak_shift = peak - zero_peak[0]
+
+    return peak, peak_shift
+
+
+@prof.profiled
+def cube_peak_shift(dir_name, chunk_size=1000):
+    '''
+    Runs batch_peak_shift over a spectral cube without loading all of it
+    into memory. The cube is memory-mapped and processed chunk_size spectra
+    at a time, using the first spectrum captured as the zero spectrum.
+    With tracking each chunk starts from a full search, as a new lock.
+    Returns the time stamps, peak and peak shift arrays.
+    Args:
+        dir_name: <string> cube directory path
+        chunk_size: <int> number of spectra processed at once
+    '''
+    cube = io.CubeReader(dir_name)
+    zero_wavelength, zero_intensity = cube.spectrum(
+        int(np.argmin(cube.time_stamps)))
+
+    time_stamps = []
+    peak = []
+    peak_shift = []
+    with io.Progress(total=len(cube),
+                     label=os.path.basename(dir_name)) as progress:
+        for chunk_time, chunk_intensity in cube.chunks(chunk_size):
+            chunk_peak, chunk_shift = batch_peak_shift(
+                x=cube.wavelength,
+                y=chunk_intensity,
+                zero_y=zero_intensity)
+            time_stamps.append(np.array(chunk_time))
+            peak.append(chunk_peak)
+            peak_shift.append(chunk_shift)
+            progress.update(len(chunk_time))
+
+    if len(cube) == 0:
+        return np.array([]), np.array([]), np.array([])
+    return (np.concatenate(time_stamps),
+            np.concatenate(peak),
+            np.concatenate(peak_shift))
+
+
+class ReferencePeakCache():
+    '''
+    Holds the peak of each reference (zero) file so that it is only loaded
+    and analysed once per experiment rather than once per spectrum. Entries
+    are keyed by file path, modification time and peak parameters, so an
+    edited zero file or a different peak window is analysed afresh. Counts
+    cache hits and misses.
+    '''
+    def __init__(self):
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def peak(self,
+             zero_file,
+             distance,
+             width,
+             xmin,
+             xmax,
+             refinement=None,
+             roi=None):
+        '''
+        Returns the peaks found in the zero file, loading the file and
+        running the peaks function only if it is not already cached. Numpy
+        array files are read with array_in, anything else with csv_in.
+        With refinement the first peak is refined with batch_peaks instead.
+        With roi the zero file is cropped to the region of interest first,
+        matching spectra read in with the same roi.
+        Args:
+            zero_file: <string> file path to sensor background image
+            distance: <int> minimum distance between peaks
+            width: <int> minimum width of peaks
+            xmin: <int> minimum value you expect a peak to occur within
+            xmax: <int> maximum value you expect a peak to occur within
+            refinement: <string> refine_peaks method, None for the peak
+                        sample
+            roi: <array> [min, max] wavelength (nm) region of interest,
+                 None for the whole spectrum
+        '''
+        zero_file = os.path.abspath(zero_file)
+        key = (zero_file,
+               os.path.getmtime(zero_file),
+               distance,
+               width,
+               xmin,
+               xmax,
+               refinement,
+               None if roi is None else tuple(roi))
+
+        if key in self.entries:
+            self.hits += 1
+        else:
+            self.misses += 1
+            if zero_file.endswith('.npy'):
+                wav_zero, int_zero, zero_file_name = io.array_in(zero_file,
+                                                                 roi=roi)
+            else:
+                wav_zero, int_zero, zero_file_name = io.csv_in(zero_file,
+                                                               roi=roi)
+            if refinement is None:
+                self.entries[key] = peaks(x=wav_zero,
+                                          y=int_zero,
+                                          distance=distance,
+                                          width=width,
+                                          xmin=xmin,
+                                          xmax=xmax)
+            else:
+                zero_peak = batch_peaks(x=wav_zero,
+                                        y=int_zero,
+                                        distance=distance,
+                                        width=width,
+                                        xmin=xmin,
+                                        xmax=xmax,
+                                        refinement=refinement)
+                self.entries[key] = list(zero_peak[~np.isnan(zero_peak)])
+        return list(self.entries[key])
+
+    def clear(self):
+        '''
+        Empties the cache and resets the hit and miss counts.
+        '''
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __str__(self):
+        return (f'{len(self.entries)} reference(s), '
+                f'{self.hits} hit(s), {self.misses} miss(es)')
+
+
+reference_cache = ReferencePeakCache()
+
+
+@prof.profiled
+def batch_bg_peaks(x, y, zero_x, zero_y):
+    '''
+    Batch version of bg_peaks. Finds the peak of every background spectrum
+    in a 2D intensity array and its shift from the sensor (zero) peak in one
+    go, with the same parameters as bg_peaks. Returns two arrays, background
+    peak and peak shift, with nan where no peak was found.
+    Args:
+        x: <array> shared wavelength array of the backgrounds, length M
+        y: <array> background intensity array, shape (N, M)
+        zero_x: <array> wavelength array of the sensor background
+        zero_y: <array> intensity array of the sensor background
+    '''
+    bg_peak = batch_peaks(x=x,
+                          y=y,
+                          distance=300,
+                          width=20,
+                          xmin=740,
+                          xmax=800)
+
+    zero_peak = batch_peaks(x=zero_x,
+                            y=zero_y,
+                            distance=300,
+                            width=20,
+                            xmin=740,
+                            xmax=800)
+
+    return bg_peak, bg_peak - zero_peak[0]
+
+
+@prof.profiled
+def bg_peaks(file, zero_file, cache=reference_cache):
     '''
     Uses ReadInValues function and FindPeaks function to find the peak
     wavelength of each background image, and find the peak wavelength
@@ -44,16 +496,15 @@ def bg_peaks(file, zero_file):
     Args:
         file: <string> file path to background image
         zero_file: <string> file path to sensor background image
+        cache: <ReferencePeakCache> cache holding the sensor peak
     '''
-    wav_naught, int_naught, zero_file_name = io.csv_in(zero_file)
     wavelength, intensity, file_name = io.csv_in(file)
 
-    zero_peak = peaks(x=wav_naught,
-                      y=int_naught,
-                      distance=300,
-                      width=20,
-                      xmin=740,
-                      xmax=800)
+    zero_peak = cache.peak(zero_file=zero_file,
+                           distance=300,
+                           width=20,
+                           xmin=740,
+                           xmax=800)
 
     bg_peak = peaks(x=wavelength,
                     y=intensity,
@@ -67,7 +518,8 @@ def bg_peaks(file, zero_file):
     return file_name, bg_peak[0], peak_shift
 
 
-def peak_shift(file, zero_file):
+@prof.profiled
+def peak_shift(file, zero_file, cache=reference_cache):
     '''
     Reads in the wavelength, intensity and file name parameters from
     an in-file and the sensor file. Then uses the FindPeaks function to
@@ -77,9 +529,9 @@ def peak_shift(file, zero_file):
     Args:
         file: <string> file path to image
         zero_file: <string> file path to sensor background image
+        cache: <ReferencePeakCache> cache holding the zero file peak
     '''
     wavelength, intensity, file_name = io.array_in(file=file)
-    wav_zero, int_zero, zero_file_name = io.array_in(file=zero_file)
 
     file_peak = peaks(x=wavelength,
                       y=intensity,
@@ -88,12 +540,11 @@ def peak_shift(file, zero_file):
                       xmin=730,
                       xmax=810)
 
-    zero_peak = peaks(x=wav_zero,
-                      y=int_zero,
-                      distance=300,
-                      width=20,
-                      xmin=740,
-                      xmax=800)
+    zero_peak = cache.peak(zero_file=zero_file,
+                           distance=300,
+                           width=20,
+                           xmin=740,
+                           xmax=800)
 
     time_stamp = (file_name.split('_')[::-1])[0]
 
@@ -0,0 +1,130 @@
+import os
+import numpy as np
+
+import GMR.DataPreparation as dprep
+
+dir_kinds = [('Background', 'background'),
+             ('Graphs', 'graphs'),
+             ('Results', 'results'),
+             ('TimeCorrected', 'time_corrected'),
+             ('TimeAdjusted', 'time_adjusted')]
+indexed_kinds = ('experiment', 'background', 'results')
+
+
+def dir_kind(dir_name):
+    '''
+    Classifies a directory within a date directory by its name, returning
+    'background', 'graphs', 'results', 'time_corrected', 'time_adjusted' or
+    'experiment' for anything else.
+    Args:
+        dir_name: <string> directory name
+    '''
+    for dir_string, kind in dir_kinds:
+        if dir_string in dir_name:
+            return kind
+    return 'experiment'
+
+
+def scan_files(dir_name):
+    '''
+    Lists the files in a directory with a single os.scandir, returning a
+    dictionary of file name to [size, mtime (ns)] in file name order, empty
+    if the directory does not exist.
+    Args:
+        dir_name: <string> directory path
+    '''
+    states = {}
+    try:
+        with os.scandir(dir_name) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    stat = entry.stat()
+                    states[entry.name] = [stat.st_size, stat.st_mtime_ns]
+    except FileNotFoundError:
+        return {}
+    return dict(sorted(states.items()))
+
+
+class DateIndex():
+    '''
+    Index of a date directory built from one scan of the date directory and
+    one of each experiment, Background and Results directory within it, so
+    the pipeline stages query it rather than listing the same directories
+    again (slow on network shares). The time sorted and Graphs directories
+    are classified but not listed. Each experiment's name is split with
+    solute_finder once, and the time stamps of its files are parsed once
+    when first asked for.
+    Args:
+        selected_date: <string> path to date directory
+    '''
+    def __init__(self, selected_date):
+        self.selected_date = selected_date
+        self.kinds = {}
+        self.files = {}
+        self.dir_params = {}
+        self.seconds = {}
+
+        with os.scandir(selected_date) as entries:
+            dirs = sorted(a.name for a in entries if a.is_dir())
+        for dir_name in dirs:
+            kind = dir_kind(dir_name)
+            self.kinds[dir_name] = kind
+            if kind in indexed_kinds:
+                self.files[dir_name] = scan_files(
+                    os.path.join(selected_date, dir_name))
+            if kind == 'experiment':
+                self.dir_params[dir_name] = dprep.solute_finder(dir_name)
+
+    def path(self, dir_name):
+        '''
+        Returns the path of a directory within the date directory.
+        Args:
+            dir_name: <string> directory name, eg.. 'Background'
+        '''
+        return os.path.join(self.selected_date, dir_name)
+
+    def file_states(self, dir_name, file_string=''):
+        '''
+        Returns the [size, mtime (ns)] of every indexed file in a directory
+        containing file_string, as a dictionary of file name to state in
+        file name order.
+        Args:
+            dir_name: <string> directory name, eg.. 'Background'
+            file_string: <string> string within desired file names
+        '''
+        return {a: state for a, state in self.files.get(dir_name, {}).items()
+                if file_string in a}
+
+    def has_file(self, dir_name, file_name):
+        '''
+        Returns True if file_name was in the directory when it was indexed.
+        Args:
+            dir_name: <string> directory name, eg.. 'Results'
+            file_name: <string> file name
+        '''
+        return file_name in self.files.get(dir_name, {})
+
+    def spectrum_files(self, exp_dir):
+        '''
+        Returns the states of the spectrum files of an experiment, those
+        named after the experiment directory.
+        Args:
+            exp_dir: <string> experiment directory name
+        '''
+        return self.file_states(exp_dir, '_'.join(self.dir_params[exp_dir]))
+
+    def time_stamps(self, exp_dir):
+        '''
+        Returns the time stamp, in seconds, of each spectrum file of an
+        experiment as a dictionary of file name to seconds, parsing the
+        file names only once. Files without a valid time stamp are left out.
+        Args:
+            exp_dir: <string> experiment directory name
+        '''
+        if exp_dir not in self.seconds:
+            file_names = list(self.spectrum_files(exp_dir))
+            total_seconds = dprep.file_time_stamps(file_names)
+            self.seconds[exp_dir] = {
+                a: float(b) for a, b in zip(file_names, total_seconds)
+                if not np.isnan(b)}
+        return self.seconds[exp_dir]
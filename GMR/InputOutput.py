@@ -1,35 +1,53 @@
 import os
 import sys
+import stat
+import time
+import threading
+import multiprocessing
 import numpy as np
+import numpy.lib.format as npformat
 import csv
+import contextlib
+from io import BytesIO
 
+import GMR.Profiling as prof
 
-def config_dir_path():
+cube_files = ('wavelength', 'intensity', 'time')
+
+
+def config_dir_path(root=None, interactive=True):
     '''
     Asigns directory path for all data, allowing user input without
     code file path alterations.
-    The current working directory (cwd) will then contain all data to
-    be analysed. A directory is created name "Put_Data_Here".
+    The root directory (defaults to the current working directory) will
+    then contain all data to be analysed. A directory is created name
+    "Put_Data_Here".
     The function waits for user to place data in the folder e.g.
     "hs_img_000", "power_spectrum.csv", "experimental_settings.txt"
     from GMR X.
     Once data is present, the function returns the "Put_Data_Here"
     directory as the main directory and then directory paths can be
     asigned.
+    When not interactive (eg.. run from cron) there is no prompt, and an
+    empty "Put_Data_Here" raises a FileNotFoundError instead of exiting.
     Args:
-        The function requires no arguments but will not work unless data
-        is present in the new (created) directory and awaits user input.
+        root: <string> directory containing "Put_Data_Here", defaults to
+              the current working directory
+        interactive: <bool> prompt the user before continuing
     '''
-    root = os.getcwd()
+    if root is None:
+        root = os.getcwd()
     main_dir = os.path.join(root, 'Put_Data_Here')
     check_dir_exists(main_dir)
 
-    while len(os.listdir(main_dir)) == 0:
+    if len(os.listdir(main_dir)) == 0:
+        if not interactive:
+            raise FileNotFoundError(f'No data in {main_dir}')
         print('Place data into "Put_Data_Here" folder with this code')
         print('Once complete, restart code')
         os.sys.exit(0)
 
-    else:
+    elif interactive:
         print('Data present in "Put_Data_Here", ensure it is correct\n')
         input('Press enter to continue...\n')
 
@@ -49,6 +67,7 @@ def file_sort(dir_name):
     return sorted(os.listdir(dir_name))
 
 
+@prof.profiled
 def extract_files(dir_name, file_string):
     '''
     Stack file names in a directory into an array. Returns data files array.
@@ -70,6 +89,7 @@ def check_dir_exists(dir_name):
         os.mkdir(dir_name)
 
 
+@prof.profiled
 def array_save(array_name, file_name, dir_name):
     '''
     Save array as file name in a given directory
@@ -98,6 +118,116 @@ def get_filename(file_path):
     return os.path.splitext(os.path.basename(file_path))[0]
 
 
+@contextlib.contextmanager
+def atomic_open(file_path, mode='w', **kwargs):
+    '''
+    Opens a uniquely named temporary file next to file_path for writing and
+    renames it over file_path once the with block finishes, so readers
+    never see a half written file and runs writing the same file never
+    share a temporary file. If the block raises, the temporary file is
+    removed and file_path is left untouched. The file keeps the permissions
+    of the file it replaces, and a new file gets the usual permissions
+    allowed by the umask.
+    Args:
+        file_path: <string> path of the file to write
+        mode: <string> open mode, 'w' or 'wb'
+        kwargs: further arguments for open, eg.. newline=''
+    '''
+    dir_name, file_name = os.path.split(os.path.abspath(file_path))
+    try:
+        file_mode = stat.S_IMODE(os.stat(file_path).st_mode)
+    except FileNotFoundError:
+        file_mode = None
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+    while True:
+        temp_path = os.path.join(dir_name,
+                                 f'.{file_name}.{os.urandom(4).hex()}.tmp')
+        try:
+            handle = os.open(temp_path, flags, 0o666)
+            break
+        except FileExistsError:
+            continue
+
+    try:
+        with os.fdopen(handle, mode, **kwargs) as outfile:
+            if file_mode is not None:
+                os.chmod(temp_path, file_mode)
+            yield outfile
+        os.replace(temp_path, file_path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+class ResultsWriter():
+    '''
+    Writes a csv results file straight into its destination through
+    atomic_open. Rows are buffered in memory and written chunk_rows at a
+    time, rather than opening the file once per row, and the file only
+    replaces any earlier one when the with block finishes without error.
+    Args:
+        file_path: <string> path of the results file
+        header: <array> column names written as the first row, or None
+        delimiter: <string> column delimiter
+        chunk_rows: <int> rows buffered before they are written out
+    '''
+    def __init__(self, file_path, header=None, delimiter=',',
+                 chunk_rows=10000):
+        self.file_path = file_path
+        self.header = header
+        self.delimiter = delimiter
+        self.chunk_rows = chunk_rows
+        self.rows = []
+        self.context = None
+        self.writer = None
+
+    def __enter__(self):
+        self.context = atomic_open(self.file_path, 'w', newline='')
+        self.writer = csv.writer(self.context.__enter__(),
+                                 delimiter=self.delimiter)
+        if self.header is not None:
+            self.writer.writerow(self.header)
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            if exc_info[0] is None:
+                self.flush()
+        except BaseException:
+            exc_info = sys.exc_info()
+            raise
+        finally:
+            self.rows = []
+            suppress = self.context.__exit__(*exc_info)
+        return suppress
+
+    def writerow(self, row):
+        '''
+        Buffers a row, writing the buffer out once it holds chunk_rows.
+        Args:
+            row: <array> values of the row
+        '''
+        self.rows.append(row)
+        if len(self.rows) >= self.chunk_rows:
+            self.flush()
+
+    def writerows(self, rows):
+        '''
+        Buffers many rows.
+        Args:
+            rows: <array> rows to write
+        '''
+        for row in rows:
+            self.writerow(row)
+
+    def flush(self):
+        '''
+        Writes the buffered rows out to the temporary file.
+        '''
+        self.writer.writerows(self.rows)
+        self.rows = []
+
+
 def update_progress(progress):
     '''
     Function to display to terminal or update a progress bar according to
@@ -134,33 +264,519 @@ def update_progress(progress):
     sys.stdout.flush()
 
 
-def csv_in(file):
+def format_seconds(seconds):
+    '''
+    Formats a duration in seconds as H:MM:SS, or M:SS under an hour.
+    Args:
+        seconds: <float> duration in seconds
+    '''
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f'{hours}:{minutes:02d}:{seconds:02d}'
+    return f'{minutes}:{seconds:02d}'
+
+
+class Progress():
+    '''
+    Throttled replacement for update_progress. Counts the items done out of
+    total and redraws at most once every interval seconds, showing the
+    items per second, elapsed time and estimated time remaining. When
+    stdout is not a terminal, or from a worker process where several bars
+    would overwrite each other, a log line is printed every log_interval
+    seconds instead. update may be called from several threads. Use as a
+    context manager, or call close, to print the final line.
+    Args:
+        total: <int> number of items to process
+        label: <string> name printed before the bar, eg.. the experiment
+        unit: <string> name of the items counted, eg.. 'spectra'
+        interval: <float> minimum seconds between redraws of the bar
+        log_interval: <float> seconds between log lines
+        stream: <file> stream to write to, defaults to sys.stdout
+    '''
+    bar_length = 30
+
+    def __init__(self,
+                 total,
+                 label='',
+                 unit='spectra',
+                 interval=0.2,
+                 log_interval=10,
+                 stream=None):
+        self.total = total
+        self.label = label
+        self.unit = unit
+        self.stream = stream or sys.stdout
+        self.count = 0
+        self.start = time.perf_counter()
+        self.lock = threading.Lock()
+        self.closed = False
+        self.terminal = (self.stream.isatty()
+                         and multiprocessing.parent_process() is None)
+        self.interval = interval if self.terminal else log_interval
+        self.last_shown = self.start
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def update(self, count=1):
+        '''
+        Adds count items to those done, redrawing if interval has passed.
+        Args:
+            count: <int> number of items just finished
+        '''
+        with self.lock:
+            self.count += count
+            now = time.perf_counter()
+            if now - self.last_shown < self.interval:
+                return
+            self.last_shown = now
+            self.show(now)
+
+    def close(self):
+        '''
+        Prints the final progress line, once.
+        '''
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.show(time.perf_counter())
+            if self.terminal:
+                self.stream.write('\n')
+            self.stream.flush()
+
+    def status(self, now):
+        '''
+        Returns the count, rate, elapsed time and ETA as a string.
+        Args:
+            now: <float> time.perf_counter() value to report at
+        '''
+        elapsed = now - self.start
+        rate = self.count / elapsed if elapsed > 0 else 0
+        text = (f'{self.count}/{self.total} {self.unit} '
+                f'{rate:.1f} {self.unit}/s '
+                f'elapsed {format_seconds(elapsed)}')
+        if 0 < rate and self.count < self.total:
+            text += f' ETA {format_seconds((self.total - self.count) / rate)}'
+        return text
+
+    def show(self, now):
+        '''
+        Writes the bar (terminal) or a log line (otherwise).
+        Args:
+            now: <float> time.perf_counter() value to report at
+        '''
+        fraction = min(self.count / self.total, 1) if self.total else 1
+        label = f'{self.label} ' if self.label else ''
+        if self.terminal:
+            block = int(round(self.bar_length * fraction))
+            bar = '#' * block + '-' * (self.bar_length - block)
+            self.stream.write(f'\r{label}[{bar}] {fraction * 100:.0f}% '
+                              f'{self.status(now)}\x1b[K')
+        else:
+            self.stream.write(f'{label}{fraction * 100:.0f}% '
+                              f'{self.status(now)}\n')
+        self.stream.flush()
+
+
+def roi_slice(wavelength, roi):
+    '''
+    Returns the slice of an ascending wavelength axis lying within the
+    region of interest roi, ends included, slice(None) if roi is None. Found
+    with two binary searches, so callers reading many files that share one
+    wavelength axis (eg.. csv_stack) find it once and reuse it.
+    Args:
+        wavelength: <array> wavelength array
+        roi: <array> [min, max] wavelength (nm) of the region of interest
+    '''
+    if roi is None or len(wavelength) == 0:
+        return slice(None)
+    return slice(int(np.searchsorted(wavelength, roi[0], side='left')),
+                 int(np.searchsorted(wavelength, roi[1], side='right')))
+
+
+@prof.profiled
+def csv_in(file, dtype=np.float64, roi=None, rows=None):
     '''
     Reads in a 2 column csv file (wavelength (nm), intensity) and unpacks
-    the file into two arrays, wavelength and intensity.
+    the file into two arrays, wavelength and intensity. Uses numpy's C
+    loadtxt parser, several times faster than genfromtxt on the
+    spectrometer's fixed two column format.
     Args:
         file: <string> file path
+        dtype: <dtype> data type of the returned arrays, eg.. np.float32
+        roi: <array> [min, max] wavelength (nm) to keep, None for all
+        rows: <slice> rows of the file to parse, with a start and stop
+              (eg.. a roi_slice of a file sharing the same wavelength
+              axis), None for all
     '''
-    global wavelength, intensity
-    wavelength, intensity = np.genfromtxt(file,
-                                          delimiter=',',
-                                          unpack=True)
+    if rows is None:
+        wavelength, intensity = np.loadtxt(file,
+                                           delimiter=',',
+                                           dtype=dtype,
+                                           unpack=True)
+    else:
+        wavelength, intensity = np.loadtxt(file,
+                                           delimiter=',',
+                                           dtype=dtype,
+                                           unpack=True,
+                                           ndmin=2,
+                                           skiprows=rows.start,
+                                           max_rows=rows.stop - rows.start)
+    if roi is not None:
+        crop = roi_slice(wavelength, roi)
+        wavelength, intensity = wavelength[crop], intensity[crop]
 
     file_name = get_filename(file)
     return wavelength, intensity, file_name
 
 
-def array_in(file):
+@prof.profiled
+def csv_stack(files, dtype=np.float64, out=None, progress=None, roi=None):
+    '''
+    Reads in many 2 column csv files sharing one wavelength axis, placing
+    the intensities into a single preallocated 2D array with one spectrum
+    per row. Returns the wavelength, intensity and file names.
+    With roi only the region of interest is kept. The first file is parsed
+    in full to find the rows of the region of interest, after which only
+    those rows of the other files are parsed.
+    Args:
+        files: <array> file paths
+        dtype: <dtype> data type of the returned arrays, eg.. np.float32
+        out: <array> optional preallocated (len(files), M) array to fill,
+             allocated from the first file if not given
+        progress: <Progress> reporter to update as each file is read, or
+                  True to create one for files
+        roi: <array> [min, max] wavelength (nm) to keep, None for all
+    '''
+    file_names = [get_filename(file) for file in files]
+    if len(files) == 0:
+        return np.array([], dtype=dtype), np.empty((0, 0), dtype=dtype), []
+    if progress is True:
+        with Progress(total=len(files)) as reporter:
+            return csv_stack(files=files,
+                             dtype=dtype,
+                             out=out,
+                             progress=reporter,
+                             roi=roi)
+
+    rows = None
+    for index, file in enumerate(files):
+        wavelength, intensity, file_name = csv_in(file,
+                                                  dtype=dtype,
+                                                  rows=rows)
+
+        if index == 0:
+            if roi is not None:
+                rows = roi_slice(wavelength, roi)
+                if rows.stop == rows.start:
+                    raise ValueError(f'No wavelengths of {file} lie within '
+                                     f'the region of interest {roi}')
+                wavelength, intensity = wavelength[rows], intensity[rows]
+            zero_wavelength = wavelength
+            if out is None:
+                out = np.empty((len(files), len(wavelength)), dtype=dtype)
+        elif not np.array_equal(wavelength, zero_wavelength):
+            raise ValueError(f'{file} does not share the wavelength axis '
+                             f'of {files[0]}')
+
+        out[index] = intensity
+
+        if progress:
+            progress.update()
+
+    return zero_wavelength, out, file_names
+
+
+@prof.profiled
+def array_in(file, roi=None):
     '''
     Load in a numpy array file, returns the wavelength, intensity and file
-    name.
+    name. If the path is a spectral cube directory (see cube_save) the
+    whole cube is loaded and intensity is returned as a 2D array with one
+    spectrum per row.
     Args:
         file: <string> file path
+        roi: <array> [min, max] wavelength (nm) to keep, None for all
     '''
+    if is_cube(file):
+        wavelength, intensity, time_stamps, file_name = cube_in(file)
+        crop = roi_slice(wavelength, roi)
+        return wavelength[crop], intensity[:, crop], file_name
+
     data = np.load(file)
     file_name = get_filename(file)
 
-    wavelength = data[:,0]
-    intensity = data[:,1]
+    data = data[roi_slice(data[:, 0], roi)]
+    wavelength, intensity = np.ascontiguousarray(data.T)
 
     return wavelength, intensity, file_name
+
+
+def is_cube(dir_name):
+    '''
+    Check whether a directory holds a spectral cube, that is a wavelength,
+    intensity and time numpy array file as written by cube_save.
+    Args:
+        dir_name: <string> directory path
+    '''
+    return all(os.path.isfile(os.path.join(dir_name, f'{part}.npy'))
+               for part in cube_files)
+
+
+@prof.profiled
+def cube_save(wavelength, intensity, time_stamps, dir_name, roi=None):
+    '''
+    Save an experiment as a spectral cube, one directory holding the shared
+    wavelength axis once, a contiguous 2D intensity array (one spectrum per
+    row) and the time stamp of each row. Replaces one numpy array file per
+    spectrum, each repeating the wavelength column. Any existing cube in the
+    directory is overwritten.
+    Args:
+        wavelength: <array> shared wavelength array, length M
+        intensity: <array> intensity array, shape (N, M)
+        time_stamps: <array> time stamp of each spectrum, length N
+        dir_name: <string> cube directory path
+        roi: <array> [min, max] wavelength (nm) to keep, None for all
+    '''
+    check_dir_exists(dir_name)
+    wavelength = np.asarray(wavelength)
+    crop = roi_slice(wavelength, roi)
+    intensity = np.ascontiguousarray(np.atleast_2d(intensity)[:, crop])
+    arrays = (wavelength[crop],
+              intensity,
+              np.asarray(time_stamps, dtype=float).reshape(-1))
+
+    for part, array in zip(cube_files, arrays):
+        np.save(os.path.join(dir_name, f'{part}.npy'), array)
+
+
+@prof.profiled
+def cube_append(wavelength, intensity, time_stamps, dir_name):
+    '''
+    Append spectra to a spectral cube, creating the cube if it does not
+    exist yet. The wavelength array must match the one already stored.
+    Intensity rows are written before the time stamps, so cube_in never
+    returns a time stamp without its spectrum.
+    Args:
+        wavelength: <array> wavelength array of the new spectra, length M
+        intensity: <array> intensity array, shape (N, M) or (M,) for a
+                   single spectrum
+        time_stamps: <array/float> time stamp(s) of the new spectra
+        dir_name: <string> cube directory path
+    '''
+    if not is_cube(dir_name):
+        cube_save(wavelength, intensity, time_stamps, dir_name)
+        return
+
+    cube_wavelength = np.load(os.path.join(dir_name, 'wavelength.npy'))
+    if not np.array_equal(cube_wavelength, wavelength):
+        raise ValueError(f'Wavelength axis does not match cube {dir_name}')
+
+    npy_append(os.path.join(dir_name, 'intensity.npy'),
+               np.atleast_2d(intensity))
+    npy_append(os.path.join(dir_name, 'time.npy'),
+               np.asarray(time_stamps, dtype=float).reshape(-1))
+
+
+class CubeWriter():
+    '''
+    Writes a spectral cube a block of spectra at a time, so an experiment
+    never has to be held in memory as a whole. Spectra are buffered and
+    written chunk_rows at a time, the first block replacing any existing
+    cube in dir_name through cube_save and later blocks being added with
+    cube_append. The buffer is written out when the with block finishes
+    without error.
+    Args:
+        dir_name: <string> cube directory path
+        chunk_rows: <int> spectra buffered before they are written out
+    '''
+    def __init__(self, dir_name, chunk_rows=1000):
+        self.dir_name = dir_name
+        self.chunk_rows = chunk_rows
+        self.wavelength = None
+        self.intensities = []
+        self.time_stamps = []
+        self.buffered = 0
+        self.written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if exc_info[0] is None:
+            self.flush()
+        return False
+
+    def write(self, wavelength, intensity, time_stamps):
+        '''
+        Buffers one spectrum, or a block of spectra, writing the buffer out
+        once it holds chunk_rows spectra.
+        Args:
+            wavelength: <array> wavelength array, length M
+            intensity: <array> intensity array, shape (N, M) or (M,) for a
+                       single spectrum
+            time_stamps: <array/float> time stamp(s) of the spectra
+        '''
+        intensity = np.atleast_2d(intensity)
+        self.wavelength = wavelength
+        self.intensities.append(intensity)
+        self.time_stamps.append(
+            np.asarray(time_stamps, dtype=float).reshape(-1))
+        self.buffered += len(intensity)
+        if self.buffered >= self.chunk_rows:
+            self.flush()
+
+    def flush(self):
+        '''
+        Writes the buffered spectra out to the cube.
+        '''
+        if self.buffered == 0:
+            return
+        intensity = np.concatenate(self.intensities)
+        time_stamps = np.concatenate(self.time_stamps)
+        if self.written == 0:
+            cube_save(wavelength=self.wavelength,
+                      intensity=intensity,
+                      time_stamps=time_stamps,
+                      dir_name=self.dir_name)
+        else:
+            cube_append(wavelength=self.wavelength,
+                        intensity=intensity,
+                        time_stamps=time_stamps,
+                        dir_name=self.dir_name)
+        self.written += self.buffered
+        self.intensities = []
+        self.time_stamps = []
+        self.buffered = 0
+
+
+def npy_append(file_path, array):
+    '''
+    Append rows to a numpy array file in place. The new rows are written to
+    the end of the file and the header shape is then updated, so existing
+    data is never rewritten. Falls back to rewriting the whole file if the
+    new header does not fit in the space of the old one.
+    Args:
+        file_path: <string> path to numpy array file
+        array: <array> rows to append, matching the stored row shape
+    '''
+    with open(file_path, 'r+b') as f:
+        version = npformat.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = npformat.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = npformat.read_array_header_2_0(f)
+        header_length = f.tell()
+
+        if fortran_order or tuple(array.shape[1:]) != tuple(shape[1:]):
+            raise ValueError(f'Cannot append shape {array.shape} to '
+                             f'{shape} in {file_path}')
+
+        new_shape = (shape[0] + array.shape[0],) + tuple(shape[1:])
+        header = {'descr': npformat.dtype_to_descr(dtype),
+                  'fortran_order': False,
+                  'shape': new_shape}
+        header_buffer = BytesIO()
+        if version == (1, 0):
+            npformat.write_array_header_1_0(header_buffer, header)
+        else:
+            npformat.write_array_header_2_0(header_buffer, header)
+
+        if len(header_buffer.getvalue()) == header_length:
+            f.seek(0, os.SEEK_END)
+            f.write(np.ascontiguousarray(array, dtype=dtype).tobytes())
+            f.seek(0)
+            f.write(header_buffer.getvalue())
+            return
+
+    data = np.concatenate((np.load(file_path), array.astype(dtype)))
+    np.save(file_path, data)
+
+
+@prof.profiled
+def cube_in(dir_name, mmap_mode=None):
+    '''
+    Load in a spectral cube, returns the wavelength, intensity (2D, one
+    spectrum per row), time stamps and cube name.
+    Args:
+        dir_name: <string> cube directory path
+        mmap_mode: <string> passed to np.load for the intensity and time
+                   arrays, eg.. 'r' to memory-map rather than read them
+    '''
+    wavelength = np.load(os.path.join(dir_name, 'wavelength.npy'))
+    intensity = np.load(os.path.join(dir_name, 'intensity.npy'),
+                        mmap_mode=mmap_mode)
+    time_stamps = np.load(os.path.join(dir_name, 'time.npy'),
+                          mmap_mode=mmap_mode)
+
+    rows = min(len(intensity), len(time_stamps))
+    cube_name = get_filename(dir_name)
+
+    return wavelength, intensity[:rows], time_stamps[:rows], cube_name
+
+
+class CubeReader():
+    '''
+    Lazy access to a spectral cube too large to hold in memory. The
+    intensity array is memory-mapped read only, so nothing is read from disk
+    until a slice of it is used. Rows (spectra) are stored contiguously, so
+    row slices are zero-copy views into the file. Wavelength windows are
+    copied out into contiguous arrays, reading only the rows asked for.
+    Args:
+        dir_name: <string> cube directory path
+    '''
+    def __init__(self, dir_name):
+        (self.wavelength,
+         self.intensity,
+         self.time_stamps,
+         self.name) = cube_in(dir_name, mmap_mode='r')
+
+    def __len__(self):
+        return len(self.time_stamps)
+
+    def spectrum(self, index):
+        '''
+        Returns the wavelength and intensity of a single spectrum.
+        Args:
+            index: <int> row of the spectrum in the cube
+        '''
+        return self.wavelength, self.intensity[index]
+
+    def rows(self, start=0, stop=None):
+        '''
+        Returns the time stamps and intensities of a block of spectra.
+        Args:
+            start: <int> first row
+            stop: <int> row to stop before, defaults to the end of the cube
+        '''
+        return self.time_stamps[start:stop], self.intensity[start:stop]
+
+    def window(self, xmin, xmax, start=0, stop=None):
+        '''
+        Returns only the part of a block of spectra between xmin and xmax,
+        the wavelength window and the matching intensity columns as a
+        C-contiguous array.
+        Args:
+            xmin: <float> minimum wavelength of the window
+            xmax: <float> maximum wavelength of the window
+            start: <int> first row
+            stop: <int> row to stop before, defaults to the end of the cube
+        '''
+        window = roi_slice(self.wavelength, [xmin, xmax])
+        return (self.wavelength[window],
+                np.ascontiguousarray(self.intensity[start:stop, window]))
+
+    def chunks(self, chunk_size):
+        '''
+        Iterates through the cube in blocks of chunk_size spectra, yielding
+        the time stamps and intensities of each block.
+        Args:
+            chunk_size: <int> number of spectra per block
+        '''
+        for start in range(0, len(self), chunk_size):
+            yield self.rows(start, start + chunk_size)
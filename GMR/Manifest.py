@@ -0,0 +1,80 @@
+import os
+import json
+import hashlib
+
+import GMR.InputOutput as io
+
+manifest_name = 'Manifest.json'
+
+
+def parameters_hash(parameters):
+    '''
+    Returns a short hash of the processing parameters (sensor, peak finding
+    parameters,...), so results made with different parameters are never
+    reused.
+    Args:
+        parameters: <dict> json serialisable processing parameters
+    '''
+    text = json.dumps(parameters, sort_keys=True)
+    return hashlib.sha1(text.encode()).hexdigest()[0:16]
+
+
+def new_manifest(parameters):
+    '''
+    Returns an empty manifest for the given processing parameters.
+    Args:
+        parameters: <dict> processing parameters of this run
+    '''
+    return {'parameters': parameters_hash(parameters),
+            'background': {},
+            'experiments': {}}
+
+
+def load_manifest(results_dir, parameters):
+    '''
+    Loads the manifest stored in a results directory. Returns an empty
+    manifest if there is none, it cannot be read, or it was made with
+    different processing parameters.
+    Args:
+        results_dir: <string> results directory path
+        parameters: <dict> processing parameters of this run
+    '''
+    empty = new_manifest(parameters)
+    try:
+        with open(os.path.join(results_dir, manifest_name)) as infile:
+            manifest = json.load(infile)
+    except (OSError, ValueError):
+        return empty
+
+    if manifest.get('parameters') != empty['parameters']:
+        return empty
+    return manifest
+
+
+def save_manifest(results_dir, manifest):
+    '''
+    Saves a manifest into a results directory, through a temporary file
+    and a rename so a crash never leaves a half written manifest.
+    Args:
+        results_dir: <string> results directory path
+        manifest: <dict> manifest to save
+    '''
+    io.check_dir_exists(results_dir)
+    file_path = os.path.join(results_dir, manifest_name)
+    with io.atomic_open(file_path) as outfile:
+        json.dump(manifest, outfile, indent=1, sort_keys=True)
+
+
+def changes(old_states, new_states):
+    '''
+    Compares two dictionaries of file name to [size, mtime] (see
+    DirectoryIndex.DateIndex.file_states). Returns the names of the new
+    files and the names of files that were changed or removed.
+    Args:
+        old_states: <dict> file states recorded in the manifest
+        new_states: <dict> file states now
+    '''
+    new_files = sorted(a for a in new_states if a not in old_states)
+    changed_files = sorted(a for a in old_states
+                           if new_states.get(a) != old_states[a])
+    return new_files, changed_files
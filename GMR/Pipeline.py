@@ -0,0 +1,650 @@
+import os
+import shutil
+import numpy as np
+
+import GMR.InputOutput as io
+import GMR.DataPreparation as dprep
+import GMR.DataProcessing as dproc
+import GMR.Plotting as plot
+import GMR.Scheduler as sched
+import GMR.Manifest as manifest
+import GMR.DirectoryIndex as dindex
+import GMR.BackgroundTable as bgtable
+import GMR.Profiling as prof
+
+stage_names = ('background', 'peaks', 'plot')
+
+
+def experiment_dirs(selected_date, index=None):
+    '''
+    Lists the experiment (solute) directories within a date directory,
+    skipping the Background, Results, Graphs and time sorted directories.
+    Returns the experiment directory paths.
+    Args:
+        selected_date: <string> path to date directory
+        index: <DateIndex> index of the date directory, built if not given
+    '''
+    if index is None:
+        index = dindex.DateIndex(selected_date)
+    print(f'\nFiles to be processed: {list(index.kinds)}')
+
+    solute_dirs = []
+    for exp_dir, kind in index.kinds.items():
+        solute_dir = index.path(exp_dir)
+        if kind == 'experiment':
+            solute_dirs.append(solute_dir)
+        else:
+            print(f'\n{solute_dir} skipped')
+    return solute_dirs
+
+
+def load_backgrounds(selected_date, sensor, bg_datafiles=None):
+    '''
+    Reads every background of a date in one go with io.csv_stack, the
+    sensor background being taken from its row rather than read again.
+    Backgrounds that do not share a wavelength axis are read one at a time
+    instead, with 'wavelength' and 'intensity' then being lists of one
+    array per file. Returns a dictionary of the backgrounds' 'wavelength',
+    'intensity' (one row per file) and 'file_names', and the sensor
+    background's 'zero_wavelength', 'zero_intensity' and 'zero_name', ready
+    for background_peaks and Plotting.backgrounds_plot.
+    Args:
+        selected_date: <string> path to date directory
+        sensor: <string> name of the photonic crystal used
+        bg_datafiles: <array> background file names, from the date's
+                      DateIndex, listed if not given
+    '''
+    bg_dir = background_dir(selected_date)
+    if bg_datafiles is None:
+        bg_datafiles = io.extract_files(dir_name=bg_dir,
+                                        file_string='_Background.csv')
+    files = [os.path.join(bg_dir, a) for a in bg_datafiles]
+    try:
+        wavelength, intensity, file_names = io.csv_stack(files=files)
+    except ValueError as error:
+        print(f'\n{error}, reading the backgrounds one at a time')
+        wavelength, intensity, file_names = (
+            list(a) for a in zip(*[io.csv_in(file) for file in files]))
+
+    zero_name = f'{sensor}_Background'
+    if zero_name in file_names:
+        row = file_names.index(zero_name)
+        zero_intensity = intensity[row]
+        if isinstance(wavelength, list):
+            zero_wavelength = wavelength[row]
+        else:
+            zero_wavelength = wavelength
+    else:
+        zero_wavelength, zero_intensity, zero_name = io.csv_in(
+            os.path.join(bg_dir, f'{zero_name}.csv'))
+    return {'wavelength': wavelength,
+            'intensity': intensity,
+            'file_names': file_names,
+            'zero_wavelength': zero_wavelength,
+            'zero_intensity': zero_intensity,
+            'zero_name': zero_name}
+
+
+def background_peaks(backgrounds):
+    '''
+    Finds the peak and peak shift of every background loaded by
+    load_backgrounds with DataProcessing.batch_bg_peaks, all at once when
+    they share a wavelength axis and one at a time otherwise. Returns two
+    arrays, background peak and peak shift, nan where no peak was found.
+    Args:
+        backgrounds: <dict> backgrounds from load_backgrounds
+    '''
+    if not isinstance(backgrounds['wavelength'], list):
+        return dproc.batch_bg_peaks(x=backgrounds['wavelength'],
+                                    y=backgrounds['intensity'],
+                                    zero_x=backgrounds['zero_wavelength'],
+                                    zero_y=backgrounds['zero_intensity'])
+
+    bg_peaks = np.full(len(backgrounds['file_names']), np.nan)
+    peak_shifts = np.full(len(backgrounds['file_names']), np.nan)
+    for index, (x, y) in enumerate(zip(backgrounds['wavelength'],
+                                       backgrounds['intensity'])):
+        bg_peak, peak_shift = dproc.batch_bg_peaks(
+            x=x,
+            y=y,
+            zero_x=backgrounds['zero_wavelength'],
+            zero_y=backgrounds['zero_intensity'])
+        bg_peaks[index] = bg_peak[0]
+        peak_shifts[index] = peak_shift[0]
+    return bg_peaks, peak_shifts
+
+
+def background_plots(bg_dir, backgrounds):
+    '''
+    Background plotting stage, run as a render job. Plots each background
+    of a date against the sensor background, saving the figures into the
+    Background directory.
+    Args:
+        bg_dir: <string> path to the date's Background directory
+        backgrounds: <dict> backgrounds from load_backgrounds, as returned
+                     by background_calibration
+    '''
+    plot.backgrounds_plot(out_dir=bg_dir,
+                          **backgrounds)
+
+
+@prof.profiled
+def background_calibration(selected_date, sensor, bg_datafiles=None):
+    '''
+    Finds the peak and peak shift of each background in the date's
+    Background directory compared to the sensor background and saves out
+    Background_Peaks.csv into the Background directory, written in one go
+    with io.ResultsWriter. The backgrounds are read once with
+    load_backgrounds and their peaks found with background_peaks. Returns
+    the loaded backgrounds, so background_plots, run as its own task, draws
+    the figures without reading the files again.
+    Args:
+        selected_date: <string> path to date directory
+        sensor: <string> name of the photonic crystal used
+        bg_datafiles: <array> background file names, from the date's
+                      DateIndex, listed if not given
+    '''
+    print('Background Calibration')
+    bg_dir = background_dir(selected_date)
+    backgrounds = load_backgrounds(selected_date=selected_date,
+                                   sensor=sensor,
+                                   bg_datafiles=bg_datafiles)
+    bg_peaks, peak_shifts = background_peaks(backgrounds)
+
+    table = bgtable.BackgroundTable(names=backgrounds['file_names'],
+                                    peaks=bg_peaks,
+                                    peak_shifts=peak_shifts)
+    outfile_path = os.path.join(bg_dir, bgtable.table_name)
+    with io.ResultsWriter(outfile_path, delimiter='\t') as writer:
+        for index, file_name in enumerate(table.names):
+            writer.writerow([file_name]
+                            + [float(table.peaks[index])]
+                            + [float(table.peak_shifts[index])])
+    bgtable.save_table(bg_dir, table)
+
+    return backgrounds
+
+
+@prof.profiled
+def write_peaks(time_stamps, peaks, peak_shifts, dir_params, results_dir):
+    '''
+    Writes the time stamp, peak and peak shift of every spectrum of an
+    experiment out to <experiment>_Peaks.csv in the results directory, with
+    empty values where no peak was found. The file is written with
+    io.ResultsWriter, so it is replaced in one atomic step and experiments
+    can safely run in parallel processes. Returns the path to the results
+    file.
+    Args:
+        time_stamps: <array> time stamp of each spectrum
+        peaks: <array> peak of each spectrum, nan where no peak was found
+        peak_shifts: <array> peak shift of each spectrum
+        dir_params: <array> solute_finder output for the experiment directory
+        results_dir: <string> results directory path
+    '''
+    io.check_dir_exists(results_dir)
+    outfile_name = (str('_'.join(dir_params))
+                   + '_Peaks.csv')
+
+    outfile_path = os.path.join(results_dir, outfile_name)
+    with io.ResultsWriter(outfile_path,
+                          header=['Wavelength [nm]',
+                                  'Peak [nm]',
+                                  'Peak Shift [nm]']) as writer:
+        for index, time_stamp in enumerate(time_stamps):
+            if np.isnan(peaks[index]):
+                peak = None
+                peak_shift = None
+            else:
+                peak = float(peaks[index])
+                peak_shift = float(peak_shifts[index])
+            writer.writerow([int(time_stamp)] + [peak] + [peak_shift])
+
+    return outfile_path
+
+
+@prof.profiled
+def plot_spectra_out(solute_dir,
+                     selected_date,
+                     data_files=None,
+                     zero_seconds=None):
+    '''
+    Spectrum plotting stage, run as a render job. Reads an experiment's
+    spectra in with ingest, time stamped the same way as process_experiment
+    does, and saves a figure of every spectrum into the experiment's _Graphs
+    directory.
+    Args:
+        solute_dir: <string> path to experiment directory
+        selected_date: <string> path to date directory
+        data_files: <array> spectrum file names to plot, defaults to every
+                    spectrum of the experiment
+        zero_seconds: <float> time stamp, in seconds, of the zero file if it
+                      is not among data_files
+    '''
+    dir_params = dprep.solute_finder(solute_dir)
+    time_stamps, wavelength, intensity = dprep.ingest(
+        in_dir_name=solute_dir,
+        dir_params=dir_params,
+        main_dir=selected_date,
+        data_files=data_files,
+        zero_seconds=zero_seconds,
+        roi=dproc.peak_parameters['roi'])
+
+    out_dir_name = '_'.join(dir_params) + '_Graphs'
+    for index, time_stamp in enumerate(time_stamps):
+        file_name = '_'.join(dir_params[0:2] + [str(int(time_stamp))])
+        plot.spectrum_plot(wavelength=wavelength,
+                           intensity=intensity[index],
+                           file_name=file_name,
+                           out_dir=os.path.join(selected_date,
+                                                out_dir_name))
+
+
+@prof.profiled
+def plot_experiment(solute_dir, bg_dir, sensor):
+    '''
+    Results plotting stage, run as a render job. Plots the experiment's
+    _Peaks.csv results file against the date's backgrounds.
+    Args:
+        solute_dir: <string> path to experiment directory
+        bg_dir: <string> background directory containing Background_Peaks.csv
+        sensor: <string> name of the photonic crystal used
+    '''
+    dir_params = dprep.solute_finder(solute_dir)
+    file = os.path.join(os.path.dirname(solute_dir),
+                        'Results',
+                        '_'.join(dir_params) + '_Peaks.csv')
+    if not os.path.isfile(file):
+        print(f'\nNo results to plot for {solute_dir}')
+        return
+
+    print(f'\nFile to be processed: {os.path.basename(file)}')
+    plot.results_plot(file=file,
+                      bg_dir=bg_dir,
+                      dir_params=dir_params,
+                      sensor=sensor)
+
+
+def read_peaks(results_file):
+    '''
+    Reads a _Peaks.csv results file back in, returns the time stamp, peak
+    and peak shift arrays with nan where no peak was found.
+    Args:
+        results_file: <string> path to _Peaks.csv results file
+    '''
+    data = np.genfromtxt(results_file,
+                         delimiter=',',
+                         skip_header=1,
+                         ndmin=2)
+    if data.size == 0:
+        return np.array([]), np.array([]), np.array([])
+    return data[:, 0], data[:, 1], data[:, 2]
+
+
+@prof.profiled
+def process_experiment(solute_dir,
+                       selected_date,
+                       save_intermediates=False,
+                       update=None,
+                       data_files=None,
+                       chunk_size=None):
+    '''
+    Experiment stage for run_tasks. Runs a single experiment directory
+    through time stamp correction and peak finding in one process, keeping
+    the spectra in memory, and writes out its _Peaks.csv. The spectra are
+    only saved out as a _TimeCorrected spectral cube if save_intermediates
+    is True. With chunk_size the experiment is never held in memory as a
+    whole: it is written chunk by chunk into its _TimeCorrected cube with
+    DataPreparation.ingest_cube and its peaks found through a memory-mapped
+    view of the cube with DataProcessing.cube_peak_shift, the cube being
+    removed afterwards unless save_intermediates is True. With update only
+    the given new spectra are processed, against the zero file of the
+    earlier run, and merged into the existing results file. Plotting is left
+    to plot_experiment and plot_spectra_out, run as render jobs.
+    Returns a summary dictionary of the experiment.
+    Args:
+        solute_dir: <string> path to experiment directory
+        selected_date: <string> path to date directory
+        save_intermediates: <bool> keep the time corrected spectral cube
+        update: <dict> 'data_files' (new file names), 'zero_file' and
+                'zero_seconds' of the earlier run, from plan_experiment
+        data_files: <array> spectrum file names for a full run, from the
+                    date's DateIndex, listed if not given
+        chunk_size: <int> spectra read and searched at once for a full
+                    run, None to hold the whole experiment in memory
+    '''
+    print('\nCorrecting Time Stamp')
+    dir_params = dprep.solute_finder(solute_dir)
+    results_dir = os.path.join(selected_date,
+                               'Results')
+
+    if update is None and chunk_size is not None:
+        cube_dir = dprep.ingest_cube(
+            in_dir_name=solute_dir,
+            dir_params=dir_params,
+            main_dir=selected_date,
+            chunk_size=chunk_size,
+            data_files=data_files,
+            roi=dproc.peak_parameters['roi'])
+        print('\nFinding Peaks')
+        time_stamps, peaks, peak_shifts = dproc.cube_peak_shift(
+            dir_name=cube_dir,
+            chunk_size=chunk_size)
+        time_stamps = time_stamps.astype(int)
+        if not save_intermediates:
+            shutil.rmtree(cube_dir)
+    elif update is None:
+        time_stamps, wavelength, intensity = dprep.ingest(
+            in_dir_name=solute_dir,
+            dir_params=dir_params,
+            main_dir=selected_date,
+            save_intermediates=save_intermediates,
+            data_files=data_files,
+            roi=dproc.peak_parameters['roi'])
+        zero_intensity = intensity[0]
+    else:
+        time_stamps, wavelength, intensity = dprep.ingest(
+            in_dir_name=solute_dir,
+            dir_params=dir_params,
+            main_dir=selected_date,
+            data_files=update['data_files'],
+            zero_seconds=update['zero_seconds'],
+            roi=dproc.peak_parameters['roi'])
+        zero_wavelength, zero_intensity, zero_name = io.csv_in(
+            os.path.join(solute_dir, update['zero_file']),
+            roi=dproc.peak_parameters['roi'])
+
+    if chunk_size is None or update is not None:
+        print('\nFinding Peaks')
+        peaks, peak_shifts = dproc.batch_peak_shift(x=wavelength,
+                                                    y=intensity,
+                                                    zero_y=zero_intensity)
+
+    if update is not None:
+        results_file = os.path.join(results_dir,
+                                    '_'.join(dir_params) + '_Peaks.csv')
+        old_time, old_peaks, old_shifts = read_peaks(results_file)
+        time_stamps = np.concatenate((old_time, time_stamps))
+        order = np.argsort(time_stamps, kind='stable')
+        time_stamps = time_stamps[order]
+        peaks = np.concatenate((old_peaks, peaks))[order]
+        peak_shifts = np.concatenate((old_shifts, peak_shifts))[order]
+
+    results_file = write_peaks(time_stamps=time_stamps,
+                               peaks=peaks,
+                               peak_shifts=peak_shifts,
+                               dir_params=dir_params,
+                               results_dir=results_dir)
+
+    return {'experiment': os.path.basename(solute_dir),
+            'spectra': len(time_stamps),
+            'peaks_found': int(np.count_nonzero(~np.isnan(peaks))),
+            'results_file': results_file}
+
+
+def init_worker(peak_parameters):
+    '''
+    Initializer of the worker and render processes. Sets the run's
+    DataProcessing.peak_parameters, which processes started with spawn (the
+    default on Windows and macOS) would otherwise read afresh from the
+    module, and forgets any render service inherited from the parent
+    process (see Plotting.reset_rendering).
+    Args:
+        peak_parameters: <dict> peak parameters of the run
+    '''
+    dproc.peak_parameters.update(peak_parameters)
+    plot.reset_rendering()
+
+
+def background_dir(selected_date):
+    '''
+    Returns the Background directory of a date.
+    Args:
+        selected_date: <string> path to date directory
+    '''
+    return os.path.join(selected_date,
+                        'Background')
+
+
+def run_parameters(sensor):
+    '''
+    Returns the processing parameters recorded in each manifest, any change
+    to which means earlier results cannot be reused. The roi is recorded as
+    floats, so [730, 810] and [730.0, 810.0] are the same run.
+    Args:
+        sensor: <string> name of the photonic crystal used
+    '''
+    peak_parameters = dict(dproc.peak_parameters)
+    if peak_parameters['roi'] is not None:
+        peak_parameters['roi'] = [float(a) for a in peak_parameters['roi']]
+    return {'sensor': sensor,
+            'peak_parameters': peak_parameters}
+
+
+def plan_experiment(solute_dir, entry, index=None):
+    '''
+    Decides how much of an experiment needs processing by comparing its
+    spectrum files with the manifest entry from the last run. Returns the
+    plan ('skip', 'update' or 'full'), the update dictionary for
+    process_experiment and the new manifest entry.
+    Only new spectra captured after the earlier zero file can be added to
+    existing results, anything else (changed or removed files, a new
+    earliest spectrum, missing results) needs a full run.
+    Args:
+        solute_dir: <string> path to experiment directory
+        entry: <dict> manifest entry of the experiment, None if absent
+        index: <DateIndex> index of the experiment's date directory, built
+               if not given
+    '''
+    if index is None:
+        index = dindex.DateIndex(os.path.dirname(solute_dir))
+    exp_dir = os.path.basename(solute_dir)
+    states = index.spectrum_files(exp_dir)
+    seconds = index.time_stamps(exp_dir)
+    results_name = '_'.join(index.dir_params[exp_dir]) + '_Peaks.csv'
+
+    if len(seconds) == 0:
+        return 'skip', None, entry
+    zero_file = min(seconds, key=seconds.get)
+    new_entry = {'files': states,
+                 'zero_file': zero_file,
+                 'zero_seconds': seconds[zero_file]}
+
+    if entry is None or not index.has_file('Results', results_name):
+        return 'full', None, new_entry
+
+    new_files, changed_files = manifest.changes(entry['files'], states)
+    if changed_files or zero_file != entry['zero_file']:
+        return 'full', None, new_entry
+    if len(new_files) == 0:
+        return 'skip', None, entry
+
+    update = {'data_files': new_files,
+              'zero_file': entry['zero_file'],
+              'zero_seconds': entry['zero_seconds']}
+    return 'update', update, new_entry
+
+
+def pipeline_tasks(root,
+                   sensor,
+                   save_intermediates=False,
+                   plot_spectra=False,
+                   incremental=True,
+                   stages=stage_names,
+                   chunk_size=None):
+    '''
+    Builds the run_tasks dependency graph for every date directory in root:
+    background calibration per date, and per experiment a process_experiment
+    task (ingest and peak finding, in memory unless chunk_size is given)
+    followed by results plotting.
+    Only results plotting waits on its date's background calibration, so no
+    experiment or date waits on another date. All figures, the backgrounds,
+    the results and (with plot_spectra) every spectrum, are made by their
+    own tasks on the 'render' pool (see Plotting.RenderService), never from
+    within a main pool task.
+    When incremental, the manifest in each Results directory is used to
+    skip backgrounds and spectra that have not changed since the last run,
+    and to only add new spectra to existing results. Experiments whose
+    figures were not made last time (the plot stage was left out or its
+    task failed) are plotted even if their spectra have not changed.
+    Only the stages named in stages are run: without 'background' the
+    existing Background_Peaks.csv files are used, without 'peaks' the
+    existing results are only plotted, and without 'plot' no figures are
+    made (so matplotlib is never imported).
+    Each date directory is scanned once into a DirectoryIndex.DateIndex,
+    and the file lists the tasks need are taken from it.
+    Returns a list of Task objects and the manifests to pass to
+    save_manifests once the tasks have run.
+    Args:
+        root: <string> directory containing the date directories
+        sensor: <string> name of the photonic crystal used
+        save_intermediates: <bool> keep the time corrected spectral cubes
+        plot_spectra: <bool> save a figure of every spectrum
+        incremental: <bool> reuse earlier results recorded in the manifests
+        stages: <array> names of the stages to run, from stage_names
+        chunk_size: <int> spectra read and searched at once, None to hold
+                    each experiment in memory (see process_experiment)
+    '''
+    unknown = set(stages) - set(stage_names)
+    if unknown:
+        raise ValueError(f'Unknown stage(s) {sorted(unknown)}')
+    plotting = 'plot' in stages
+    plot_spectra = plot_spectra and plotting
+
+    parameters = run_parameters(sensor)
+    tasks = []
+    manifests = {}
+    for date_dir in os.listdir(root):
+        selected_date = os.path.join(root,
+                                     date_dir)
+        print(f'Looking at: {date_dir}')
+        index = dindex.DateIndex(selected_date)
+
+        results_dir = os.path.join(selected_date,
+                                   'Results')
+        if incremental:
+            date_manifest = manifest.load_manifest(results_dir, parameters)
+        else:
+            date_manifest = manifest.new_manifest(parameters)
+        updates = {}
+        plots = {}
+        manifests[results_dir] = (date_manifest, updates, plots)
+
+        bg_task = f'background:{date_dir}'
+        bg_dir = background_dir(selected_date)
+        bg_states = index.file_states('Background', '_Background.csv')
+        bg_changed = 'background' in stages and (
+            date_manifest['background'].get('files') != bg_states
+            or not index.has_file('Background', 'Background_Peaks.csv'))
+
+        if bg_changed:
+            tasks.append(sched.Task(name=bg_task,
+                                    function=background_calibration,
+                                    kwargs=dict(selected_date=selected_date,
+                                                sensor=sensor,
+                                                bg_datafiles=list(bg_states))))
+            updates[bg_task] = ('background', {'files': bg_states})
+            bg_dependencies = [bg_task]
+            if plotting:
+                tasks.append(sched.Task(
+                    name=f'bgplot:{date_dir}',
+                    function=background_plots,
+                    kwargs=dict(bg_dir=bg_dir),
+                    inputs=dict(backgrounds=bg_task),
+                    pool='render'))
+        else:
+            if 'background' in stages:
+                print('Background unchanged')
+            bg_dependencies = []
+
+        for solute_dir in experiment_dirs(selected_date, index=index):
+            exp_dir = os.path.basename(solute_dir)
+            exp_name = f'{date_dir}/{exp_dir}'
+            plan, update, entry = plan_experiment(
+                solute_dir=solute_dir,
+                entry=date_manifest['experiments'].get(exp_dir),
+                index=index)
+            data_files = list(index.spectrum_files(exp_dir))
+            print(f'{exp_dir}: {plan}')
+
+            if plan == 'skip' or 'peaks' not in stages:
+                unplotted = entry is not None and not entry.get('plotted')
+                if plotting and (bg_changed
+                                 or 'peaks' not in stages
+                                 or unplotted):
+                    plots[f'plot:{exp_name}'] = exp_dir
+                    tasks.append(sched.Task(
+                        name=f'plot:{exp_name}',
+                        function=plot_experiment,
+                        kwargs=dict(solute_dir=solute_dir,
+                                    bg_dir=bg_dir,
+                                    sensor=sensor),
+                        dependencies=bg_dependencies,
+                        pool='render'))
+                continue
+
+            updates[f'peaks:{exp_name}'] = (exp_dir, entry)
+            tasks.append(sched.Task(
+                name=f'peaks:{exp_name}',
+                function=process_experiment,
+                kwargs=dict(solute_dir=solute_dir,
+                            selected_date=selected_date,
+                            save_intermediates=save_intermediates,
+                            update=update,
+                            data_files=data_files,
+                            chunk_size=chunk_size)))
+            if not plotting:
+                continue
+            plots[f'plot:{exp_name}'] = exp_dir
+            if plot_spectra:
+                if update is None:
+                    new_files, zero_seconds = data_files, None
+                else:
+                    new_files = update['data_files']
+                    zero_seconds = update['zero_seconds']
+                tasks.append(sched.Task(
+                    name=f'spectra:{exp_name}',
+                    function=plot_spectra_out,
+                    kwargs=dict(solute_dir=solute_dir,
+                                selected_date=selected_date,
+                                data_files=new_files,
+                                zero_seconds=zero_seconds),
+                    dependencies=[f'peaks:{exp_name}'],
+                    pool='render'))
+            tasks.append(sched.Task(
+                name=f'plot:{exp_name}',
+                function=plot_experiment,
+                kwargs=dict(solute_dir=solute_dir,
+                            bg_dir=bg_dir,
+                            sensor=sensor),
+                dependencies=[f'peaks:{exp_name}'] + bg_dependencies,
+                pool='render'))
+    return tasks, manifests
+
+
+def save_manifests(manifests, results):
+    '''
+    Records the backgrounds and experiments whose tasks completed in the
+    manifests from pipeline_tasks and saves them into their Results
+    directories. Failed tasks are left out, so they are retried next run.
+    Each experiment plotted this run is marked 'plotted' if its plot task
+    completed, and not if it failed or was skipped, so its figures are made
+    next run even when its spectra have not changed.
+    Args:
+        manifests: <dict> manifests returned by pipeline_tasks
+        results: <dict> task name to return value from run_tasks
+    '''
+    for results_dir, (date_manifest, updates, plots) in manifests.items():
+        done = [name for name in updates if name in results]
+        if not done and not plots:
+            continue
+        for name in done:
+            key, entry = updates[name]
+            if key == 'background':
+                date_manifest['background'] = entry
+            else:
+                date_manifest['experiments'][key] = entry
+        for name, exp_dir in plots.items():
+            entry = date_manifest['experiments'].get(exp_dir)
+            if entry is not None:
+                entry['plotted'] = name in results
+        manifest.save_manifest(results_dir, date_manifest)
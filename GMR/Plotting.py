@@ -0,0 +1,415 @@
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+import GMR.InputOutput as io
+import GMR.BackgroundTable as bgtable
+import GMR.Profiling as prof
+
+renderer = None
+combined_results = False ## Set True for one two panel results figure ##
+results_panels = {'peak': ('b.', 'Peak [nm]', 2),
+                  'shift': ('r.', 'Peak Shift [nm]', 3)}
+results_figures = {}
+max_results_figures = 8
+decimation_threshold = 20000 ## Points above which traces are decimated ##
+
+
+class RenderService():
+    '''
+    Pool of worker processes that render and save figures with the Agg
+    backend, so the numerical pipeline does not wait on matplotlib. The
+    pool is handed to Scheduler.run_tasks as its 'render' pool, which runs
+    the figure tasks on it and records any that fail.
+    Args:
+        workers: <int> number of rendering processes
+        initializer: <function> called with initargs at the start of each
+                     rendering process, defaults to reset_rendering
+        initargs: <tuple> arguments for initializer
+    '''
+    def __init__(self, workers=1, initializer=None, initargs=()):
+        self.pool = ProcessPoolExecutor(max_workers=workers,
+                                        initializer=(initializer
+                                                     or reset_rendering),
+                                        initargs=initargs)
+
+    def close(self):
+        '''
+        Waits for all queued jobs to finish and shuts the pool down.
+        '''
+        self.pool.shutdown(wait=True)
+
+
+def start_rendering(workers=1, initializer=None, initargs=()):
+    '''
+    Starts the module's render service. Returns the RenderService.
+    Args:
+        workers: <int> number of rendering processes
+        initializer: <function> called with initargs at the start of each
+                     rendering process, it must call reset_rendering,
+                     defaults to reset_rendering
+        initargs: <tuple> arguments for initializer
+    '''
+    global renderer
+    renderer = RenderService(workers=workers,
+                             initializer=initializer,
+                             initargs=initargs)
+    return renderer
+
+
+def stop_rendering():
+    '''
+    Waits for the module's render service to finish and stops it.
+    '''
+    global renderer
+    if renderer is not None:
+        renderer.close()
+        renderer = None
+
+
+def reset_rendering():
+    '''
+    Worker process initializer. A worker forked after start_rendering
+    inherits the parent's render service, which only the parent may use or
+    stop. This forgets the inherited service in the worker.
+    '''
+    global renderer
+    renderer = None
+
+
+def pyplot():
+    '''
+    Imports matplotlib with the Agg backend on first use and returns pyplot,
+    so runs that make no figures never pay for importing matplotlib.
+    '''
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+
+@prof.profiled
+def backgrounds_plot(wavelength,
+                     intensity,
+                     file_names,
+                     zero_wavelength,
+                     zero_intensity,
+                     zero_name,
+                     out_dir):
+    '''
+    Plots every background of a date, already loaded in memory (see
+    Pipeline.load_backgrounds), against the sensor spectrum, saving one
+    figure per background named after its file.
+    Args:
+        wavelength: <array> shared wavelength array of the backgrounds, or
+                    a list of one wavelength array per file
+        intensity: <array> background intensity array, one row per file
+        file_names: <array> background file names, one per row
+        zero_wavelength: <array> wavelength array of the sensor background
+        zero_intensity: <array> intensity array of the sensor background
+        zero_name: <string> sensor background file name
+        out_dir: <string> directory to save the figures into
+    '''
+    for index, file_name in enumerate(file_names):
+        if isinstance(wavelength, list):
+            file_wavelength = wavelength[index]
+        else:
+            file_wavelength = wavelength
+        background_figure(wavelength=file_wavelength,
+                          intensity=intensity[index],
+                          file_name=file_name,
+                          wav_naught=zero_wavelength,
+                          int_naught=zero_intensity,
+                          zero_name=zero_name,
+                          out_dir=out_dir)
+
+
+def background_figure(wavelength,
+                      intensity,
+                      file_name,
+                      wav_naught,
+                      int_naught,
+                      zero_name,
+                      out_dir):
+    '''
+    Draws one background spectrum against the sensor spectrum and saves
+    the figure out as <file_name>.png in out_dir.
+    Args:
+        wavelength: <array> background wavelength array
+        intensity: <array> background intensity array
+        file_name: <string> background file name
+        wav_naught: <array> sensor wavelength array
+        int_naught: <array> sensor intensity array
+        zero_name: <string> sensor background file name
+        out_dir: <string> directory to save the figure into
+    '''
+    plt = pyplot()
+    fig, ax = plt.subplots(1, 1, figsize=[10,7])
+    ax.plot(wavelength, intensity, 'r', lw=2, label=file_name)
+    ax.plot(wav_naught, int_naught, 'b', lw=2, label=zero_name)
+    ax.grid(True)
+    ax.legend(frameon=True, loc=0, ncol=1, prop={'size':12})
+    ax.set_xlabel('Wavelength [nm]', fontsize=14)
+    ax.set_ylabel('Intensity', fontsize=14)
+    ax.set_title(file_name, fontsize=18)
+    ax.tick_params(axis='both', which='major', labelsize=14)
+    fig.tight_layout()
+
+    graph_out_path = os.path.join(out_dir,
+                                  f'{file_name}.png')
+    with prof.profiler.stage('Plotting.savefig'):
+        plt.savefig(graph_out_path)
+    fig.clf()
+    plt.close(fig)
+
+
+@prof.profiled
+def spectrum_plot(wavelength, intensity, file_name, out_dir):
+    '''
+    Plots a single spectrum and saves the figure out as a png named
+    file_name in out_dir, creating out_dir if needed.
+    Args:
+        wavelength: <array> wavelength array
+        intensity: <array> intensity array
+        file_name: <string> figure title and file name
+        out_dir: <string> directory to save the figure into
+    '''
+    plt = pyplot()
+    fig, ax = plt.subplots(1, 1, figsize=[10,7])
+    ax.plot(wavelength, intensity, 'b', lw=2, label=file_name)
+    ax.grid(True)
+    ax.legend(frameon=True, loc=0, ncol=1, prop={'size':12})
+    ax.set_xlabel('Wavelength [nm]', fontsize=14)
+    ax.set_ylabel('Intensity [au]', fontsize=14)
+    ax.set_title(file_name, fontsize=18)
+    ax.tick_params(axis='both', which='major', labelsize=14)
+    fig.tight_layout()
+
+    io.check_dir_exists(out_dir)
+    out_path = os.path.join(out_dir,
+                            f'{file_name}.png')
+    with prof.profiler.stage('Plotting.savefig'):
+        plt.savefig(out_path)
+    fig.clf()
+    plt.close(fig)
+
+
+def decimate(x, y, bins, threshold=None, x_range=None):
+    '''
+    Min/max decimation of a trace for plotting. The x range is split into
+    bins (eg.. one per horizontal pixel of the axes) and only the lowest
+    and highest point of each bin are kept, in their original order, so the
+    plotted envelope and any outliers look the same as with every point.
+    Traces of threshold points or fewer are returned unchanged. Points
+    with a nan coordinate, which are never drawn, are dropped.
+    Returns the decimated x and y arrays.
+    Args:
+        x: <array> x values, eg.. time
+        y: <array> y values, eg.. peak
+        bins: <int> number of horizontal bins
+        threshold: <int> number of points above which the trace is
+                   decimated, defaults to the module's decimation_threshold
+        x_range: <array> [min, max] x values shown, points outside are
+                 dropped, defaults to the range of x
+    '''
+    if threshold is None:
+        threshold = decimation_threshold
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if len(x) <= threshold:
+        return x, y
+
+    shown = ~(np.isnan(x) | np.isnan(y))
+    if x_range is not None:
+        shown &= (x >= x_range[0]) & (x <= x_range[1])
+    x, y = x[shown], y[shown]
+    if len(x) == 0:
+        return x, y
+    low, high = x_range if x_range is not None else (x.min(), x.max())
+    if high <= low:
+        return x, y
+
+    column = np.clip(((x - low) / (high - low) * bins).astype(int),
+                     0,
+                     bins - 1)
+    order = np.lexsort((y, column))
+    ordered = column[order]
+    starts = np.flatnonzero(np.r_[True, ordered[1:] != ordered[:-1]])
+    ends = np.r_[starts[1:], len(order)] - 1
+    keep = np.unique(np.concatenate((order[starts], order[ends])))
+    return x[keep], y[keep]
+
+
+class ResultsFigure():
+    '''
+    Template for the results figures: the figure, axes, grid, labels,
+    legend and background reference lines are built once, and each
+    experiment only swaps in its line data, legend label and title before
+    the figure is saved. panels lists the quantities plotted, one axes per
+    entry from results_panels, so ['peak', 'shift'] gives the combined two
+    panel figure sharing the time axis. The layout is fixed by
+    tight_layout on the first draw. Long traces are drawn through decimate,
+    one bin per horizontal pixel of the axes.
+    Args:
+        panels: <array> quantities to plot, keys of results_panels
+        reference_lines: <array> (row, name, peak, peak shift) of each
+                         background to mark, from
+                         BackgroundTable.reference_lines
+    '''
+    def __init__(self, panels, reference_lines):
+        plt = pyplot()
+        self.fig, axes = plt.subplots(len(panels),
+                                      1,
+                                      figsize=[10, 7 + 4 * (len(panels) - 1)],
+                                      sharex=True,
+                                      squeeze=False)
+        self.axes = list(axes[:, 0])
+        self.lines = []
+        self.legends = []
+        self.laid_out = False
+
+        for ax, panel in zip(self.axes, panels):
+            style, y_label, column = results_panels[panel]
+            line, = ax.plot([], [], style, label=' ')
+            self.lines.append(line)
+            ax.grid(True)
+            self.legends.append(ax.legend(frameon=True,
+                                          loc=0,
+                                          ncol=1,
+                                          prop={'size':12}))
+            for reference in reference_lines:
+                index, name = reference[0:2]
+                ax.axhline(y=reference[column],
+                           linewidth=2,
+                           color='C' + str(index % 9),
+                           linestyle=':')
+
+                ax.text(x=2 * index,
+                        y=reference[column],
+                        s=' '.join(name.split('_')[0:-1]),
+                        bbox=dict(facecolor='white',
+                                  edgecolor='none',
+                                  alpha=0.5),
+                        horizontalalignment='center',
+                        verticalalignment='center',
+                        fontsize=8)
+            ax.set_ylabel(y_label, fontsize=14)
+            ax.tick_params(axis='both', which='major', labelsize=14)
+        self.axes[-1].set_xlabel('Time [min]', fontsize=14)
+        self.title = self.axes[0].set_title('', fontsize=18)
+
+    def draw(self, time, values, label, out_path):
+        '''
+        Swaps in an experiment's data, label and title and saves the figure.
+        Args:
+            time: <array> time of each point, the shared x axis
+            values: <array> y values of each panel, in panels order
+            label: <string> legend label and title of the experiment
+            out_path: <string> path to save the figure to
+        '''
+        for ax, line, legend, y in zip(self.axes,
+                                       self.lines,
+                                       self.legends,
+                                       values):
+            line.set_data(*decimate(x=time,
+                                    y=y,
+                                    bins=max(int(ax.bbox.width), 1)))
+            legend.get_texts()[0].set_text(label)
+            ax.relim()
+            ax.autoscale_view()
+        self.title.set_text(label)
+
+        if not self.laid_out:
+            self.fig.tight_layout()
+            self.laid_out = True
+        with prof.profiler.stage('Plotting.savefig'):
+            self.fig.savefig(out_path)
+
+    def close(self):
+        '''
+        Closes the figure.
+        '''
+        pyplot().close(self.fig)
+
+
+def results_figure(panels, reference_lines, reuse=True):
+    '''
+    Returns a ResultsFigure for panels and reference_lines. With reuse the
+    figure is kept in results_figures and returned again for the next
+    experiment with the same backgrounds, so within a date (and render
+    process) it is only built once. The oldest figures are closed once
+    more than max_results_figures are kept.
+    Args:
+        panels: <array> quantities to plot, keys of results_panels
+        reference_lines: <array> from BackgroundTable.reference_lines
+        reuse: <bool> keep the figure for later experiments
+    '''
+    if not reuse:
+        return ResultsFigure(panels, reference_lines)
+    key = (tuple(panels), repr(reference_lines))
+    if key not in results_figures:
+        while len(results_figures) >= max_results_figures:
+            results_figures.pop(next(iter(results_figures))).close()
+        results_figures[key] = ResultsFigure(panels, reference_lines)
+    return results_figures[key]
+
+
+@prof.profiled
+def results_plot(file,
+                 bg_dir,
+                 dir_params,
+                 sensor,
+                 table=None,
+                 combined=None,
+                 reuse=True):
+    '''
+    Plots the peak and the peak shift against time from a _Peaks.csv results
+    file, marking the peaks of the relevant backgrounds with horizontal
+    lines (if Background_Peaks.csv exists). Both figures are saved out next
+    to the results file, or with combined a single two panel
+    <file>_Combined.png. The figures are drawn from ResultsFigure templates
+    kept between calls (see results_figure).
+    Args:
+        file: <string> file path to _Peaks.csv results file
+        bg_dir: <string> background directory containing Background_Peaks.csv
+        dir_params: <array> solute_finder output for the experiment directory
+        sensor: <string> name of the photonic crystal used
+        table: <BackgroundTable> the date's background table, loaded from
+               bg_dir with BackgroundTable.load_table if not given
+        combined: <bool> save one two panel figure, defaults to the
+                  module's combined_results
+        reuse: <bool> reuse the figure templates, False builds and closes
+               new figures every call
+    '''
+    if combined is None:
+        combined = combined_results
+    results_dir = os.path.dirname(file)
+    file_name = io.get_filename(file)
+
+    if table is None:
+        table = bgtable.load_table(bg_dir)
+    reference_lines = table.reference_lines(dir_params=dir_params,
+                                            sensor=sensor)
+
+    time, peak, peak_shift = np.genfromtxt(file,
+                                           delimiter=',',
+                                           unpack=True)
+    time *= 1/60
+    label = ' '.join(file_name.split('_')[0:2])
+
+    if combined:
+        jobs = [(['peak', 'shift'], [peak, peak_shift], '_Combined')]
+    else:
+        jobs = [(['peak'], [peak], ''),
+                (['shift'], [peak_shift], '_Shift')]
+    for panels, values, suffix in jobs:
+        figure = results_figure(panels=panels,
+                                reference_lines=reference_lines,
+                                reuse=reuse)
+        figure.draw(time=time,
+                    values=values,
+                    label=label,
+                    out_path=os.path.join(results_dir,
+                                          f'{file_name}{suffix}.png'))
+        if not reuse:
+            figure.close()
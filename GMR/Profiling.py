@@ -0,0 +1,241 @@
+import os
+import json
+import time
+import glob
+import shutil
+import cProfile
+import functools
+import contextlib
+import multiprocessing.util
+import numpy as np
+
+environment_dir = 'GMR_PROFILE_DIR'
+environment_pid = 'GMR_PROFILE_PID'
+
+
+def io_counts():
+    '''
+    Returns the number of bytes this process has read and written so far
+    (rchar and wchar of /proc/self/io), None where that is not available.
+    '''
+    try:
+        with open('/proc/self/io') as infile:
+            counts = dict(line.split(':') for line in infile)
+        return int(counts['rchar']), int(counts['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+class StageProfiler():
+    '''
+    Opt-in timing of pipeline stages. While enabled, each stage call records
+    its wall clock time and the bytes the process read and wrote during it;
+    nested stages are included in the stage that calls them. Worker
+    processes started after enable record into files in the profile
+    directory when they exit, so report covers the whole run.
+    '''
+    def __init__(self):
+        self.enabled = False
+        self.profile_dir = None
+        self.main_pid = None
+        self.records = {}
+        multiprocessing.util.register_after_fork(self,
+                                                 StageProfiler.child_started)
+
+    def enable(self, profile_dir, main_pid=None):
+        '''
+        Starts recording stage timings in this process and in worker
+        processes started from it.
+        Args:
+            profile_dir: <string> directory the worker processes save their
+                         records into
+            main_pid: <int> process collecting the report, defaults to this
+                      process
+        '''
+        self.enabled = True
+        self.profile_dir = profile_dir
+        self.main_pid = main_pid or os.getpid()
+        self.records = {}
+        os.environ[environment_dir] = profile_dir
+        os.environ[environment_pid] = str(self.main_pid)
+        if os.getpid() != self.main_pid:
+            multiprocessing.util.Finalize(self, self.save, exitpriority=10)
+
+    def disable(self):
+        '''
+        Stops recording, in this process and in new worker processes.
+        '''
+        self.enabled = False
+        os.environ.pop(environment_dir, None)
+        os.environ.pop(environment_pid, None)
+
+    def child_started(self):
+        '''
+        Called in a newly forked worker process, dropping the records
+        inherited from the parent so they are not counted twice.
+        '''
+        self.records = {}
+        if self.enabled:
+            multiprocessing.util.Finalize(self, self.save, exitpriority=10)
+
+    def record(self, name, seconds, bytes_read=0, bytes_written=0):
+        '''
+        Records one call of a stage.
+        Args:
+            name: <string> stage name
+            seconds: <float> wall clock time of the call
+            bytes_read: <int> bytes read during the call
+            bytes_written: <int> bytes written during the call
+        '''
+        entry = self.records.setdefault(name, [[], 0, 0])
+        entry[0].append(seconds)
+        entry[1] += bytes_read
+        entry[2] += bytes_written
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        '''
+        Context manager timing the code inside it as a call of stage name,
+        doing nothing unless the profiler is enabled.
+        Args:
+            name: <string> stage name
+        '''
+        if not self.enabled:
+            yield
+            return
+        counts = io_counts()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            if counts is None:
+                self.record(name, seconds)
+            else:
+                after = io_counts()
+                self.record(name,
+                            seconds,
+                            after[0] - counts[0],
+                            after[1] - counts[1])
+
+    def save(self):
+        '''
+        Saves this worker process's records into the profile directory.
+        '''
+        if not self.records or os.getpid() == self.main_pid:
+            return
+        file_path = os.path.join(self.profile_dir,
+                                 f'stages_{os.getpid()}.json')
+        with open(file_path, 'w') as outfile:
+            json.dump(self.records, outfile)
+
+    def report(self):
+        '''
+        Combines the records of this process and of every worker process
+        that has exited, returning a dictionary of stage name to the call
+        count, total, mean, 95th percentile and maximum time in seconds and
+        the bytes read and written, slowest stage (by total) first.
+        '''
+        records = {}
+        processes = [self.records]
+        for file_path in glob.glob(os.path.join(self.profile_dir,
+                                                'stages_*.json')):
+            with open(file_path) as infile:
+                processes.append(json.load(infile))
+
+        for process_records in processes:
+            for name, (times, bytes_read, bytes_written) in \
+                    process_records.items():
+                entry = records.setdefault(name, [[], 0, 0])
+                entry[0].extend(times)
+                entry[1] += bytes_read
+                entry[2] += bytes_written
+
+        stages = {}
+        for name, (times, bytes_read, bytes_written) in sorted(
+                records.items(), key=lambda a: -sum(a[1][0])):
+            times = np.array(times)
+            stages[name] = {'calls': len(times),
+                            'total': float(times.sum()),
+                            'mean': float(times.mean()),
+                            'p95': float(np.percentile(times, 95)),
+                            'max': float(times.max()),
+                            'bytes_read': bytes_read,
+                            'bytes_written': bytes_written}
+        return {'processes': len(processes),
+                'stages': stages}
+
+
+profiler = StageProfiler()
+if os.environ.get(environment_dir):
+    profiler.enable(profile_dir=os.environ[environment_dir],
+                    main_pid=int(os.environ[environment_pid]))
+
+
+def profiled(function):
+    '''
+    Decorator timing every call of function as a stage named
+    <module>.<function> (eg.. 'InputOutput.csv_in') when the profiler is
+    enabled.
+    Args:
+        function: <function> function to time
+    '''
+    name = f'{function.__module__.split(".")[-1]}.{function.__name__}'
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not profiler.enabled:
+            return function(*args, **kwargs)
+        with profiler.stage(name):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+def start(report_file):
+    '''
+    Enables the module's profiler for a run whose report will be saved to
+    report_file by finish.
+    Args:
+        report_file: <string> path to save the json report to
+    '''
+    profile_dir = os.path.join(os.path.dirname(os.path.abspath(report_file)),
+                               f'.{os.path.basename(report_file)}.workers')
+    shutil.rmtree(profile_dir, ignore_errors=True)
+    os.makedirs(profile_dir)
+    profiler.enable(profile_dir=profile_dir)
+
+
+def finish(report_file, **details):
+    '''
+    Disables the module's profiler and saves its report, with any extra
+    details of the run, as json to report_file. Returns the report.
+    Args:
+        report_file: <string> path to save the json report to
+        details: extra json serialisable entries for the report
+    '''
+    report = dict(details)
+    report['created'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+    report.update(profiler.report())
+    profiler.disable()
+    shutil.rmtree(profiler.profile_dir, ignore_errors=True)
+
+    with open(report_file, 'w') as outfile:
+        json.dump(report, outfile, indent=1)
+    return report
+
+
+def cprofile_call(function, profile_file, **kwargs):
+    '''
+    Runs function under cProfile, dumping the statistics to profile_file
+    (readable with pstats or snakeviz). Returns the return value of
+    function.
+    Args:
+        function: <function> function to profile
+        profile_file: <string> path to dump the statistics to
+        kwargs: keyword arguments for function
+    '''
+    profile = cProfile.Profile()
+    try:
+        return profile.runcall(function, **kwargs)
+    finally:
+        profile.dump_stats(profile_file)
@@ -0,0 +1,183 @@
+from concurrent.futures import (ProcessPoolExecutor,
+                                Future,
+                                wait,
+                                FIRST_COMPLETED)
+
+
+class Task():
+    '''
+    A unit of work for run_tasks. The function is called with kwargs plus,
+    for every entry in inputs, the return value of the named dependency
+    task passed in as that keyword argument. Tasks listed in dependencies
+    must finish first but their return values are not passed in.
+    Args:
+        name: <string> unique task name
+        function: <function> module level function to run (must be
+                  picklable to run in a process pool)
+        kwargs: <dict> keyword arguments for function
+        inputs: <dict> keyword argument name to dependency task name
+        dependencies: <array> names of other tasks that must finish first
+        pool: <string> name of the run_tasks pool to run on, eg.. 'render',
+              defaults to the main worker pool
+    '''
+    def __init__(self,
+                 name,
+                 function,
+                 kwargs=None,
+                 inputs=None,
+                 dependencies=(),
+                 pool=None):
+        self.name = name
+        self.function = function
+        self.kwargs = dict(kwargs or {})
+        self.inputs = dict(inputs or {})
+        self.dependencies = set(dependencies) | set(self.inputs.values())
+        self.pool = pool
+
+    def arguments(self, results):
+        '''
+        Returns the keyword arguments for function, including the return
+        values of the input tasks.
+        Args:
+            results: <dict> task name to return value of finished tasks
+        '''
+        kwargs = dict(self.kwargs)
+        for argument, task_name in self.inputs.items():
+            kwargs[argument] = results[task_name]
+        return kwargs
+
+    def __repr__(self):
+        return f'Task({self.name})'
+
+
+class InlineExecutor():
+    '''
+    Stand-in for a concurrent.futures executor that runs each submitted
+    function straight away in this process, returning a finished Future.
+    '''
+    def submit(self, function, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(function(*args, **kwargs))
+        except Exception as error:
+            future.set_exception(error)
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+def check_tasks(tasks):
+    '''
+    Checks that task names are unique, that every dependency is a known
+    task and that there are no dependency cycles. Raises a ValueError if
+    not. Returns a dictionary of task name to task.
+    Args:
+        tasks: <array> Task objects
+    '''
+    graph = {}
+    for task in tasks:
+        if task.name in graph:
+            raise ValueError(f'Duplicate task name {task.name}')
+        graph[task.name] = task
+
+    for task in tasks:
+        unknown = task.dependencies - set(graph)
+        if unknown:
+            raise ValueError(f'{task.name} depends on unknown task(s) '
+                             f'{sorted(unknown)}')
+
+    remaining = {name: set(task.dependencies) for name, task in graph.items()}
+    while remaining:
+        ready = [name for name, deps in remaining.items() if not deps]
+        if not ready:
+            raise ValueError(f'Dependency cycle between tasks '
+                             f'{sorted(remaining)}')
+        for name in ready:
+            del remaining[name]
+        for deps in remaining.values():
+            deps.difference_update(ready)
+
+    return graph
+
+
+def run_tasks(tasks, workers=1, pools=None, initializer=None, initargs=()):
+    '''
+    Runs a dependency graph of tasks, starting each task as soon as all of
+    its dependencies have finished. With more than one worker tasks run on
+    a process pool of that size, otherwise they run one at a time in this
+    process. Tasks naming a pool run on that executor instead, eg.. a
+    separate pool for rendering figures. A task that raises does not stop
+    the run; it is recorded and every task depending on it is skipped.
+    Returns two dictionaries, task name to return value and task name to
+    error for failed or skipped tasks.
+    Args:
+        tasks: <array> Task objects
+        workers: <int> maximum number of tasks running at once
+        pools: <dict> pool name to executor for tasks naming a pool
+        initializer: <function> called with initargs at the start of each
+                     worker process of the main pool
+        initargs: <tuple> arguments for initializer
+    '''
+    graph = check_tasks(tasks)
+    for task in tasks:
+        if task.pool is not None and task.pool not in (pools or {}):
+            raise ValueError(f'{task.name} needs unknown pool {task.pool}')
+
+    waiting = {name: set(task.dependencies) for name, task in graph.items()}
+    results = {}
+    errors = {}
+
+    def finished(name):
+        '''
+        Removes a finished task from what its dependents wait on, and skips
+        the dependents of failed tasks (and their dependents in turn).
+        '''
+        failed = [name] if name in errors else []
+        for deps in waiting.values():
+            deps.discard(name)
+        while failed:
+            failed_name = failed.pop()
+            for other in list(waiting):
+                if failed_name in graph[other].dependencies:
+                    del waiting[other]
+                    errors[other] = RuntimeError(f'Skipped, {failed_name} '
+                                                 f'did not complete')
+                    failed.append(other)
+
+    if workers > 1:
+        main_pool = ProcessPoolExecutor(max_workers=workers,
+                                        initializer=initializer,
+                                        initargs=initargs)
+    else:
+        main_pool = InlineExecutor()
+
+    running = {}
+
+    def submit_ready():
+        for name in [name for name, deps in waiting.items() if not deps]:
+            del waiting[name]
+            task = graph[name]
+            if task.pool is None:
+                pool = main_pool
+            else:
+                pool = pools[task.pool]
+            running[pool.submit(task.function,
+                                **task.arguments(results))] = name
+
+    try:
+        submit_ready()
+        while running:
+            done, not_done = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as error:
+                    errors[name] = error
+                finished(name)
+            submit_ready()
+    finally:
+        main_pool.shutdown()
+
+    return results, errors
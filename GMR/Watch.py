@@ -0,0 +1,248 @@
+import os
+import csv
+import time
+import numpy as np
+
+import GMR.InputOutput as io
+import GMR.DataPreparation as dprep
+import GMR.DataProcessing as dproc
+import GMR.Plotting as plot
+
+
+class ExperimentWatcher():
+    '''
+    Follows an experiment directory while the spectrometer is still writing
+    timed sequence csv files into it. The directory is polled, and each new
+    spectrum is time stamped, its peak found against the cached zero file
+    peak, and its row appended to the experiment's _Peaks.csv in Results.
+    The peak and peak shift figures are then refreshed, at most once every
+    plot_interval seconds.
+    A file is only read once its size has stopped changing between two
+    polls, and a file that still cannot be parsed is retried on later polls
+    before being reported as bad, so half written files are never used.
+    The latency from a file being written (its modification time) to its
+    point being plotted is recorded for every spectrum.
+    An existing _Peaks.csv is left alone unless overwrite is True, in which
+    case it is only replaced, through io.atomic_open, once the first new
+    row is ready.
+    Args:
+        solute_dir: <string> path to experiment directory being written to
+        bg_dir: <string> background directory, Background_Peaks.csv is used
+                for the figures if present
+        sensor: <string> name of the photonic crystal used
+        poll_interval: <float> seconds between directory polls
+        plot_interval: <float> minimum seconds between figure refreshes
+        retries: <int> polls a file may fail to parse before it is skipped
+        overwrite: <bool> replace the experiment's existing results file,
+                   otherwise a FileExistsError is raised if there is one
+    '''
+    def __init__(self,
+                 solute_dir,
+                 bg_dir,
+                 sensor,
+                 poll_interval=0.5,
+                 plot_interval=2.0,
+                 retries=5,
+                 overwrite=False):
+        self.solute_dir = solute_dir
+        self.bg_dir = bg_dir
+        self.sensor = sensor
+        self.poll_interval = poll_interval
+        self.plot_interval = plot_interval
+        self.retries = retries
+
+        self.dir_params = dprep.solute_finder(solute_dir)
+        self.file_string = '_'.join(self.dir_params)
+        results_dir = os.path.join(os.path.dirname(solute_dir), 'Results')
+        io.check_dir_exists(results_dir)
+        self.results_file = os.path.join(results_dir,
+                                         self.file_string + '_Peaks.csv')
+        if os.path.exists(self.results_file) and not overwrite:
+            raise FileExistsError(f'{self.results_file} already exists, '
+                                  f'watch with overwrite to replace it')
+
+        self.sizes = {}
+        self.failures = {}
+        self.done = set()
+        self.bad_files = []
+        self.zero_file = None
+        self.zero_seconds = None
+        self.unplotted = []
+        self.latencies = []
+        self.last_plot = 0
+        self.rows = 0
+
+    def ready_files(self):
+        '''
+        Returns the new files in the experiment directory whose size has
+        not changed since the previous poll, oldest time stamp first. Files
+        whose names do not end in a time stamp (eg.. a spectrometer .tmp
+        file still being written, or notes) are ignored.
+        '''
+        file_names = [a for a in io.extract_files(dir_name=self.solute_dir,
+                                                  file_string=self.file_string)
+                      if a not in self.done]
+        ready = []
+        for file_name, total_seconds in zip(
+                file_names, dprep.file_time_stamps(file_names)):
+            if np.isnan(total_seconds):
+                continue
+            try:
+                size = os.path.getsize(os.path.join(self.solute_dir,
+                                                    file_name))
+            except OSError:
+                continue
+            if size > 0 and self.sizes.get(file_name) == size:
+                ready.append((total_seconds, file_name))
+            self.sizes[file_name] = size
+        return [a[1] for a in sorted(ready)]
+
+    def process(self, file_name):
+        '''
+        Finds the peak of a single new spectrum and appends its row to the
+        results file. The first spectrum processed becomes the zero file,
+        and its row is written together with the header as a new results
+        file. If the zero file has no peak, the peak shifts are written as
+        nan, as batch_peak_shift does.
+        Args:
+            file_name: <string> name of the spectrum file
+        '''
+        file = os.path.join(self.solute_dir, file_name)
+        modified = os.path.getmtime(file)
+        wavelength, intensity, name = io.csv_in(
+            file,
+            roi=dproc.peak_parameters['roi'])
+        if len(wavelength) == 0 or len(wavelength) != len(intensity):
+            raise ValueError(f'{file_name} is incomplete')
+
+        total_seconds = dprep.file_time_stamps([name])[0]
+        if np.isnan(total_seconds):
+            raise ValueError(f'{file_name} has no valid time stamp')
+        if self.zero_file is None:
+            self.zero_file = file
+            self.zero_seconds = total_seconds
+
+        zero_peak = dproc.reference_cache.peak(
+            zero_file=self.zero_file,
+            distance=dproc.peak_parameters['distance'],
+            width=dproc.peak_parameters['width'],
+            xmin=dproc.peak_parameters['zero_window'][0],
+            xmax=dproc.peak_parameters['zero_window'][1],
+            refinement=dproc.peak_parameters['refinement'],
+            roi=dproc.peak_parameters['roi'])
+        peak = dproc.batch_peaks(
+            x=wavelength,
+            y=intensity,
+            distance=dproc.peak_parameters['distance'],
+            width=dproc.peak_parameters['width'],
+            xmin=dproc.peak_parameters['peak_window'][0],
+            xmax=dproc.peak_parameters['peak_window'][1],
+            refinement=dproc.peak_parameters['refinement'])[0]
+        if len(zero_peak) > 0:
+            zero_peak = float(zero_peak[0])
+        else:
+            zero_peak = np.nan
+
+        if np.isnan(peak):
+            row = [None, None]
+        else:
+            row = [float(peak), float(peak) - zero_peak]
+        row = [int(total_seconds - self.zero_seconds)] + row
+        if self.rows == 0:
+            with io.atomic_open(self.results_file, 'w', newline='') as outfile:
+                writer = csv.writer(outfile, delimiter=',')
+                writer.writerow(['Wavelength [nm]']
+                                + ['Peak [nm]']
+                                + ['Peak Shift [nm]'])
+                writer.writerow(row)
+        else:
+            with open(self.results_file, 'a', newline='') as outfile:
+                writer = csv.writer(outfile, delimiter=',')
+                writer.writerow(row)
+        self.rows += 1
+
+        self.unplotted.append(modified)
+
+    def refresh_plot(self, force=False):
+        '''
+        Redraws the peak and peak shift figures if there are new points and
+        at least plot_interval seconds have passed since the last refresh,
+        then records the latency of every newly plotted point.
+        Args:
+            force: <bool> redraw regardless of plot_interval
+        '''
+        if not self.unplotted:
+            return
+        if not force and time.time() - self.last_plot < self.plot_interval:
+            return
+
+        plot.results_plot(file=self.results_file,
+                          bg_dir=self.bg_dir,
+                          dir_params=self.dir_params,
+                          sensor=self.sensor)
+        self.last_plot = time.time()
+        self.latencies.extend(self.last_plot - a for a in self.unplotted)
+        self.unplotted = []
+
+    def poll(self):
+        '''
+        Processes every file that is ready and refreshes the figures.
+        Returns the number of spectra processed.
+        '''
+        processed = 0
+        for file_name in self.ready_files():
+            try:
+                self.process(file_name)
+            except (ValueError, OSError) as error:
+                self.failures[file_name] = self.failures.get(file_name, 0) + 1
+                if self.failures[file_name] >= self.retries:
+                    self.done.add(file_name)
+                    self.bad_files.append((file_name, error))
+                    print(f'\n{file_name} skipped: {error}')
+                continue
+            self.done.add(file_name)
+            processed += 1
+        self.refresh_plot()
+        return processed
+
+    def latency_report(self):
+        '''
+        Returns a dictionary summarising the file written to point plotted
+        latency (seconds) of every plotted spectrum.
+        '''
+        if not self.latencies:
+            return {'spectra': 0}
+        latencies = np.array(self.latencies)
+        return {'spectra': len(latencies),
+                'mean': float(latencies.mean()),
+                'p95': float(np.percentile(latencies, 95)),
+                'max': float(latencies.max())}
+
+    def run(self, idle_timeout=None):
+        '''
+        Polls the experiment directory until interrupted (Ctrl+C), or until
+        no new spectrum has arrived for idle_timeout seconds. Returns the
+        latency report.
+        Args:
+            idle_timeout: <float> seconds without new spectra before
+                          stopping, None to run until interrupted
+        '''
+        print(f'Watching {self.solute_dir}')
+        last_new = time.time()
+        try:
+            while True:
+                if self.poll() > 0:
+                    last_new = time.time()
+                    report = self.latency_report()
+                    if report['spectra'] > 0:
+                        print(f'\r{len(self.done)} spectra, latency mean '
+                              f'{report["mean"]:.2f} s, max '
+                              f'{report["max"]:.2f} s', end='')
+                elif (idle_timeout is not None
+                      and time.time() - last_new > idle_timeout):
+                    break
+                time.sleep(self.poll_interval)
+        except KeyboardInterrupt:
+            pass
+        self.refresh_plot(force=True)
+        return self.latency_report()
@@ -0,0 +1,95 @@
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import GMR.DataProcessing as dproc
+from benchmarks import synthetic
+
+windows = {'peak_window': [730, 810],
+           'zero_window': [740, 800]}
+
+
+def make_spectra(number, points, seed=0):
+    '''
+    Returns a wavelength array and a 2D intensity array of synthetic
+    spectra, one per row, covering the cases the peak finders must agree
+    on: a single resonance anywhere from 700 to 840 nm (inside and outside
+    the peak windows), two resonances (one either side of the windows'
+    edges), weak resonances close to the height threshold, and noise only
+    rows with no peak at all.
+    Args:
+        number: <int> number of spectra of each kind
+        points: <int> number of wavelength points per spectrum
+        seed: <int> random seed
+    '''
+    rng = np.random.default_rng(seed)
+    wavelength = np.linspace(500, 1000, points)
+    spectra = []
+    for centre in rng.uniform(700, 840, number):
+        spectra.append(synthetic.resonance(wavelength, centre, rng))
+    for first, second in zip(rng.uniform(700, 760, number),
+                             rng.uniform(770, 840, number)):
+        spectra.append(synthetic.resonance(wavelength, first, rng)
+                       + synthetic.resonance(wavelength, second, rng,
+                                             baseline=0))
+    for centre in rng.uniform(730, 810, number):
+        spectra.append(synthetic.resonance(wavelength, centre, rng,
+                                           height=rng.uniform(5, 60)))
+    for index in range(number):
+        spectra.append(rng.normal(0, 5, points) + 50)
+    return wavelength, np.array(spectra)
+
+
+def check_window(wavelength, intensity, xmin, xmax):
+    '''
+    Runs peaks row by row and batch_peaks over all rows at once with the
+    pipeline's distance and width, and compares the first peak within
+    xmin/xmax of each row (nan where peaks finds none). Returns the number
+    of rows with a peak and the rows where the two disagree.
+    Args:
+        wavelength: <array> shared wavelength array
+        intensity: <array> 2D intensity array, one spectrum per row
+        xmin: <int> minimum wavelength of the peak window
+        xmax: <int> maximum wavelength of the peak window
+    '''
+    parameters = dict(distance=dproc.peak_parameters['distance'],
+                      width=dproc.peak_parameters['width'],
+                      xmin=xmin,
+                      xmax=xmax)
+    expected = []
+    for row in intensity:
+        row_peaks = dproc.peaks(x=wavelength, y=row, **parameters)
+        expected.append(row_peaks[0] if row_peaks else np.nan)
+    expected = np.array(expected)
+
+    found = dproc.batch_peaks(x=wavelength, y=intensity, **parameters)
+    mismatched = np.flatnonzero(~((found == expected)
+                                  | (np.isnan(found) & np.isnan(expected))))
+    return int(np.count_nonzero(~np.isnan(expected))), mismatched
+
+
+def main(number=250, points=2048):
+    wavelength, intensity = make_spectra(number, points)
+
+    thresholds = np.array([sum(row) / len(row) for row in intensity])
+    difference = np.abs(intensity.mean(axis=1) - thresholds).max()
+    print(f'{len(intensity)} spectra x {points} points')
+    print(f'height threshold, y.mean vs sum(y)/len(y): largest difference '
+          f'{difference:.3g}')
+
+    failed = False
+    for name, (xmin, xmax) in windows.items():
+        with_peak, mismatched = check_window(wavelength, intensity, xmin, xmax)
+        print(f'{name} {xmin}-{xmax} nm: {with_peak} rows with a peak, '
+              f'{len(intensity) - with_peak} without, '
+              f'{len(mismatched)} mismatched')
+        for row in mismatched[0:10]:
+            print(f'    row {row} differs')
+        failed = failed or len(mismatched) > 0
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(*[int(a) for a in sys.argv[1:3]]))
@@ -0,0 +1,74 @@
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import GMR.InputOutput as io
+
+
+def write_spectra(dir_name, number, points):
+    '''
+    Writes a number of synthetic 2 column (wavelength, intensity) csv
+    spectra into a directory, in the same format as the spectrometer.
+    Returns the file paths.
+    Args:
+        dir_name: <string> directory to write to
+        number: <int> number of spectra
+        points: <int> number of wavelength points per spectrum
+    '''
+    rng = np.random.default_rng(0)
+    wavelength = np.linspace(500, 1000, points)
+    files = []
+    for index in range(number):
+        intensity = (1000 / (1 + ((wavelength - 770) / 4) ** 2)
+                     + rng.normal(0, 5, points))
+        file = os.path.join(dir_name, f'spectrum_{index}.csv')
+        np.savetxt(file, np.vstack((wavelength, intensity)).T, delimiter=',')
+        files.append(file)
+    return files
+
+
+def time_it(function, files, repeat=1):
+    '''
+    Returns the wall clock time, in seconds, taken to run function over
+    files, the fastest of repeat runs.
+    Args:
+        function: <function> called with the list of files
+        files: <array> file paths
+        repeat: <int> number of runs
+    '''
+    timings = []
+    for index in range(repeat):
+        start = time.perf_counter()
+        function(files)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main(number=500, points=2048, repeat=5):
+    with tempfile.TemporaryDirectory() as dir_name:
+        files = write_spectra(dir_name, number, points)
+
+        timings = {
+            'genfromtxt': time_it(
+                lambda files: [np.genfromtxt(a, delimiter=',', unpack=True)
+                               for a in files], files, repeat),
+            'csv_in float64': time_it(
+                lambda files: [io.csv_in(a) for a in files], files, repeat),
+            'csv_in float32': time_it(
+                lambda files: [io.csv_in(a, dtype=np.float32)
+                               for a in files], files, repeat),
+            'csv_stack float64': time_it(io.csv_stack, files, repeat),
+        }
+
+    print(f'{number} spectra x {points} points, best of {repeat}')
+    for name, seconds in timings.items():
+        print(f'{name:>18}: {number / seconds:8.0f} spectra/s '
+              f'({timings["genfromtxt"] / seconds:.1f}x genfromtxt)')
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:4]])
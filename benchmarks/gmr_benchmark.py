@@ -0,0 +1,476 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import platform
+import subprocess
+import functools
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import GMR.InputOutput as io
+import GMR.DataPreparation as dprep
+import GMR.DataProcessing as dproc
+from benchmarks import synthetic
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def peak_rss():
+    '''
+    Returns the peak resident set size, in MB, of this process and its
+    finished child processes, None where the resource module is not
+    available (Windows).
+    '''
+    if resource is None:
+        return None
+    rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+              resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    if sys.platform == 'darwin':
+        return rss / 1024 ** 2
+    return rss / 1024
+
+
+def experiment_dirs(main_dir):
+    '''
+    Returns the experiment directory paths of a synthetic data set.
+    Args:
+        main_dir: <string> Put_Data_Here directory
+    '''
+    exp_dirs = []
+    for date_dir in sorted(os.listdir(main_dir)):
+        selected_date = os.path.join(main_dir, date_dir)
+        for exp_dir in sorted(os.listdir(selected_date)):
+            if exp_dir != 'Background':
+                exp_dirs.append(os.path.join(selected_date, exp_dir))
+    return exp_dirs
+
+
+def spectrum_files(exp_dir):
+    '''
+    Returns the spectrum file paths of an experiment directory.
+    Args:
+        exp_dir: <string> experiment directory
+    '''
+    return [os.path.join(exp_dir, a)
+            for a in io.extract_files(dir_name=exp_dir,
+                                      file_string='.csv')]
+
+
+def bench_csv_in(main_dir, work_dir):
+    '''
+    Reads every spectrum with csv_in.
+    Returns the number of spectra and the seconds taken.
+    Args:
+        main_dir: <string> Put_Data_Here directory of the data set
+        work_dir: <string> scratch directory
+    '''
+    files = [a for exp_dir in experiment_dirs(main_dir)
+             for a in spectrum_files(exp_dir)]
+    start = time.perf_counter()
+    for file in files:
+        io.csv_in(file)
+    return len(files), time.perf_counter() - start
+
+
+def bench_peaks(main_dir, work_dir):
+    '''
+    Finds the peak of every spectrum with peaks, the spectra having been
+    read in beforehand.
+    Returns the number of spectra and the seconds taken.
+    Args:
+        main_dir: <string> Put_Data_Here directory of the data set
+        work_dir: <string> scratch directory
+    '''
+    spectra = [io.csv_in(a) for exp_dir in experiment_dirs(main_dir)
+               for a in spectrum_files(exp_dir)]
+    from scipy.signal import find_peaks  # imported lazily by peaks
+    start = time.perf_counter()
+    for wavelength, intensity, file_name in spectra:
+        dproc.peaks(x=wavelength,
+                    y=intensity,
+                    distance=300,
+                    width=20,
+                    xmin=730,
+                    xmax=810)
+    return len(spectra), time.perf_counter() - start
+
+
+def bench_refined_peaks(main_dir, work_dir, refinement='parabolic'):
+    '''
+    Finds the refined peak of every spectrum with batch_peaks, one experiment
+    at a time, the spectra having been read in beforehand.
+    Returns the number of spectra and the seconds taken.
+    Args:
+        main_dir: <string> Put_Data_Here directory of the data set
+        work_dir: <string> scratch directory
+        refinement: <string> DataProcessing.refine_peaks method
+    '''
+    experiments = [io.csv_stack(spectrum_files(exp_dir))
+                   for exp_dir in experiment_dirs(main_dir)]
+    from scipy.signal import find_peaks  # imported lazily by batch_peaks
+    start = time.perf_counter()
+    for wavelength, intensity, file_names in experiments:
+        dproc.batch_peaks(x=wavelength,
+                          y=intensity,
+                          distance=300,
+                          width=20,
+                          xmin=730,
+                          xmax=810,
+                          refinement=refinement)
+    return (sum(len(a[2]) for a in experiments),
+            time.perf_counter() - start)
+
+
+def bench_tracked_peaks(main_dir, work_dir, refinement=None):
+    '''
+    Finds the peak of every spectrum with track_peaks, one experiment at a
+    time in time order, the spectra having been read in beforehand.
+    Returns the number of spectra and the seconds taken.
+    Args:
+        main_dir: <string> Put_Data_Here directory of the data set
+        work_dir: <string> scratch directory
+        refinement: <string> DataProcessing.refine_peaks method
+    '''
+    experiments = [io.csv_stack(dprep.sort_by_time_stamp(
+                       spectrum_files(exp_dir))[0])
+                   for exp_dir in experiment_dirs(main_dir)]
+    from scipy.signal import find_peaks  # imported lazily by track_peaks
+    start = time.perf_counter()
+    for wavelength, intensity, file_names in experiments:
+        dproc.track_peaks(x=wavelength,
+                          y=intensity,
+                          distance=300,
+                          width=20,
+                          xmin=730,
+                          xmax=810,
+                          refinement=refinement)
+    return (sum(len(a[2]) for a in experiments),
+            time.perf_counter() - start)
+
+
+def time_sort_all(main_dir, work_dir):
+    '''
+    Runs time_sort over every experiment, returning the number of spectra
+    and the _TimeAdjusted directories.
+    Args:
+        main_dir: <string> Put_Data_Here directory of the data set
+        work_dir: <string> directory to save the _TimeAdjusted spectra into
+    '''
+    spectra = 0
+    adjusted_dirs = []
+    for exp_dir in experiment_dirs(main_dir):
+        dir_params = dprep.solute_finder(exp_dir)
+        out_dir = os.path.join(work_dir,
+                               os.path.basename(os.path.dirname(exp_dir)))
+        os.makedirs(out_dir, exist_ok=True)
+        dprep.time_sort(in_dir_name=exp_dir,
+                        dir_params=dir_params,
+                        main_dir=out_dir)
+        spectra += len(spectrum_files(exp_dir))
+        adjusted_dirs.append(os.path.join(
+            out_dir, '_'.join(dir_params) + '_TimeAdjusted'))
+    return spectra, adjusted_dirs
+
+
+def time_correct_all(adjusted_dirs):
+    '''
+    Runs time_correct over every _TimeAdjusted directory, returning the
+    _TimeCorrected directories.
+    Args:
+        adjusted_dirs: <array> _TimeAdjusted directories from time_sort_all
+    '''
+    corrected_dirs = []
+    for adjusted_dir in adjusted_dirs:
+        dir_params = dprep.solute_finder(adjusted_dir)
+        main_dir = os.path.dirname(adjusted_dir)
+        dprep.time_correct(in_dir_name=adjusted_dir,
+                           dir_params=dir_params,
+                           main_dir=main_dir)
+        corrected_dirs.append(os.path.join(
+            main_dir, '_'.join(dir_params[0:-1]) + '_TimeCorrected'))
+    return corrected_dirs
+
+
+def bench_time_sort(main_dir, work_dir):
+    '''
+    Runs time_sort over every experiment.
+    Returns the number of spectra and the seconds taken.
+    Args:
+        main_dir: <string> Put_Data_Here directory of the data set
+        work_dir: <string> scratch directory
+    '''
+    start = time.perf_counter()
+    spectra, adjusted_dirs = time_sort_all(main_dir, work_dir)
+    return spectra, time.perf_counter() - start
+
+
+def bench_time_correct(main_dir, work_dir):
+    '''
+    Runs time_correct over the time_sort output of every experiment.
+    Returns the number of spectra and the seconds taken.
+    Args:
+        main_dir: <string> Put_Data_Here directory of the data set
+        work_dir: <string> scratch directory
+    '''
+    spectra, adjusted_dirs = time_sort_all(main_dir, work_dir)
+    start = time.perf_counter()
+    time_correct_all(adjusted_dirs)
+    return spectra, time.perf_counter() - start
+
+
+def bench_peak_shift(main_dir, work_dir):
+    '''
+    Runs peak_shift over the time_correct output of every experiment,
+    against each experiment's zero file.
+    Returns the number of spectra and the seconds taken.
+    Args:
+        main_dir: <string> Put_Data_Here directory of the data set
+        work_dir: <string> scratch directory
+    '''
+    spectra, adjusted_dirs = time_sort_all(main_dir, work_dir)
+    corrected_dirs = time_correct_all(adjusted_dirs)
+    dproc.reference_cache.clear()
+    from scipy.signal import find_peaks  # imported lazily by peaks
+    start = time.perf_counter()
+    for corrected_dir in corrected_dirs:
+        files = [os.path.join(corrected_dir, a)
+                 for a in io.extract_files(dir_name=corrected_dir,
+                                           file_string='.npy')]
+        zero_file = [a for a in files if a.endswith('_0.npy')][0]
+        for file in files:
+            dproc.peak_shift(file=file,
+                             zero_file=zero_file)
+    return spectra, time.perf_counter() - start
+
+
+def bench_pipeline(main_dir, work_dir, workers=1):
+    '''
+    Runs the whole gmr_peakplotter flow, backgrounds, peaks and figures,
+    over a copy of the data set.
+    Returns the number of spectra and the seconds taken.
+    Args:
+        main_dir: <string> Put_Data_Here directory of the data set
+        work_dir: <string> scratch directory
+        workers: <int> number of worker processes
+    '''
+    import gmr_peakplotter
+    shutil.copytree(main_dir, os.path.join(work_dir, 'Put_Data_Here'))
+    spectra = sum(len(spectrum_files(a)) for a in experiment_dirs(main_dir))
+    start = time.perf_counter()
+    gmr_peakplotter.main(root=work_dir,
+                         workers=workers,
+                         render_workers=workers,
+                         incremental=False,
+                         interactive=False)
+    return spectra, time.perf_counter() - start
+
+
+def bench_results_plot(main_dir, work_dir, combined=False, reuse=True):
+    '''
+    Plots the results of every experiment with results_plot, the
+    backgrounds and results having been made beforehand by the pipeline
+    without its plotting stage. With reuse False every figure is built and
+    closed again, as results_plot used to.
+    Returns the number of results files plotted and the seconds taken, so
+    the spectra/s reported for these cases counts results files.
+    Args:
+        main_dir: <string> Put_Data_Here directory of the data set
+        work_dir: <string> scratch directory
+        combined: <bool> one two panel figure per experiment
+        reuse: <bool> reuse the figure templates
+    '''
+    import gmr_peakplotter
+    import GMR.Plotting as plot
+    copy_dir = os.path.join(work_dir, 'Put_Data_Here')
+    shutil.copytree(main_dir, copy_dir)
+    jobs = []
+    for exp_dir in experiment_dirs(copy_dir):
+        dir_params = dprep.solute_finder(exp_dir)
+        selected_date = os.path.dirname(exp_dir)
+        jobs.append(dict(file=os.path.join(selected_date,
+                                           'Results',
+                                           '_'.join(dir_params)
+                                           + '_Peaks.csv'),
+                         bg_dir=os.path.join(selected_date, 'Background'),
+                         dir_params=dir_params))
+    gmr_peakplotter.main(root=work_dir,
+                         incremental=False,
+                         stages=['background', 'peaks'],
+                         interactive=False)
+    plot.pyplot()
+    start = time.perf_counter()
+    for job in jobs:
+        plot.results_plot(sensor=synthetic.sensor,
+                          combined=combined,
+                          reuse=reuse,
+                          **job)
+    return len(jobs), time.perf_counter() - start
+
+
+cases = {'csv_in': bench_csv_in,
+         'peaks': bench_peaks,
+         'refined_peaks': bench_refined_peaks,
+         'tracked_peaks': bench_tracked_peaks,
+         'time_sort': bench_time_sort,
+         'time_correct': bench_time_correct,
+         'peak_shift': bench_peak_shift,
+         'results_plot_create': functools.partial(bench_results_plot,
+                                                  reuse=False),
+         'results_plot': bench_results_plot,
+         'results_plot_combined': functools.partial(bench_results_plot,
+                                                    combined=True),
+         'pipeline': bench_pipeline}
+
+
+def run_case(name, main_dir, **kwargs):
+    '''
+    Runs a single benchmark case in a scratch directory, with its printing
+    silenced. Meant to run in a fresh process so the peak RSS belongs to
+    this case alone. Returns the number of spectra, the seconds taken and
+    the peak RSS in MB.
+    Args:
+        name: <string> key of cases
+        main_dir: <string> Put_Data_Here directory of the data set
+        kwargs: extra keyword arguments for the case
+    '''
+    with tempfile.TemporaryDirectory() as work_dir:
+        with open(os.devnull, 'w') as devnull:
+            with contextlib.redirect_stdout(devnull):
+                spectra, seconds = cases[name](main_dir, work_dir, **kwargs)
+    return spectra, seconds, peak_rss()
+
+
+def git_commit():
+    '''
+    Returns the current git commit of the repository, None if unknown.
+    '''
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark(names=tuple(cases), dates=1, experiments=2, spectra=100,
+              points=2048, repeat=1, workers=1):
+    '''
+    Generates a synthetic data set and times each benchmark case on it,
+    every run in its own process. Returns the report dictionary, with the
+    best (fastest) run of each case in spectra/s.
+    Args:
+        names: <array> benchmark cases to run, keys of cases
+        dates: <int> number of date directories
+        experiments: <int> number of experiments per date
+        spectra: <int> number of spectra per experiment
+        points: <int> number of wavelength points per spectrum
+        repeat: <int> number of runs of each case
+        workers: <int> worker processes for the pipeline case
+    '''
+    report = {'commit': git_commit(),
+              'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'python': platform.python_version(),
+              'numpy': np.__version__,
+              'machine': platform.machine(),
+              'dataset': {'dates': dates,
+                          'experiments': experiments,
+                          'spectra': spectra,
+                          'points': points},
+              'results': {}}
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        main_dir = synthetic.make_dataset(root=data_dir,
+                                          dates=dates,
+                                          experiments=experiments,
+                                          spectra=spectra,
+                                          points=points)
+        for name in names:
+            kwargs = {'workers': workers} if name == 'pipeline' else {}
+            runs = []
+            for index in range(repeat):
+                with ProcessPoolExecutor(max_workers=1) as pool:
+                    runs.append(pool.submit(run_case, name, main_dir,
+                                            **kwargs).result())
+            number, seconds, rss = min(runs, key=lambda a: a[1])
+            if rss is not None:
+                rss = max(a[2] for a in runs)
+            report['results'][name] = {'spectra': number,
+                                       'seconds': seconds,
+                                       'spectra_per_s': number / seconds,
+                                       'peak_rss_mb': rss,
+                                       'runs': [a[1] for a in runs]}
+            print(f'{name:>21}: {number / seconds:10.1f} spectra/s, '
+                  f'{seconds:8.3f} s, peak RSS {rss or 0:7.1f} MB')
+    return report
+
+
+def compare(report, old_report):
+    '''
+    Prints the spectra/s of each case against an earlier report.
+    Args:
+        report: <dict> report from benchmark
+        old_report: <dict> earlier report to compare against
+    '''
+    print(f'\nAgainst {old_report.get("commit")} '
+          f'({old_report.get("created")}):')
+    if old_report.get('dataset') != report['dataset']:
+        print('Warning, the data sets differ')
+    for name, result in report['results'].items():
+        old = old_report['results'].get(name)
+        if old is None:
+            continue
+        ratio = result['spectra_per_s'] / old['spectra_per_s']
+        print(f'{name:>21}: {ratio:6.2f}x spectra/s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Time the GMR pipeline on a synthetic data set')
+    parser.add_argument('--cases',
+                        default=','.join(cases),
+                        help=f'comma separated cases, from {",".join(cases)}')
+    parser.add_argument('--dates', type=int, default=1)
+    parser.add_argument('--experiments', type=int, default=2)
+    parser.add_argument('--spectra', type=int, default=100)
+    parser.add_argument('--points', type=int, default=2048)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--output',
+                        default='benchmark_report.json',
+                        help='path to write the json report to')
+    parser.add_argument('--compare',
+                        help='earlier json report to compare against')
+    args = parser.parse_args()
+
+    names = [a for a in args.cases.split(',') if a]
+    unknown = set(names) - set(cases)
+    if unknown:
+        parser.error(f'unknown case(s) {",".join(sorted(unknown))}')
+
+    report = benchmark(names=names,
+                       dates=args.dates,
+                       experiments=args.experiments,
+                       spectra=args.spectra,
+                       points=args.points,
+                       repeat=args.repeat,
+                       workers=args.workers)
+    with open(args.output, 'w') as outfile:
+        json.dump(report, outfile, indent=1)
+    print(f'Report saved to {args.output}')
+
+    if args.compare:
+        with open(args.compare) as infile:
+            compare(report, json.load(infile))
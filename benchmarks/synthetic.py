@@ -0,0 +1,160 @@
+import os
+import sys
+import numpy as np
+
+sensor = 'Nanohole_Array'
+concentrations = ['1M', '2M', '5M', '0.5M']
+solutes = ['Salt', 'Sugar', 'Glucose']
+conditions = ['Heat', 'Cold', 'Room']
+backgrounds = ['1M_Salt', 'DI', 'IPA']
+
+
+def resonance(wavelength, centre, rng, width=4, height=1000, noise=5,
+              baseline=50):
+    '''
+    Returns a synthetic GMR spectrum, a Lorentzian resonance on a flat
+    baseline with gaussian noise added.
+    Args:
+        wavelength: <array> wavelength array
+        centre: <float> resonant wavelength
+        rng: <Generator> numpy random generator
+        width: <float> half width of the resonance at half maximum
+        height: <float> resonance height above the baseline
+        noise: <float> standard deviation of the noise
+        baseline: <float> baseline intensity
+    '''
+    return (height / (1 + ((wavelength - centre) / width) ** 2)
+            + rng.normal(0, noise, len(wavelength))
+            + baseline)
+
+
+def time_string(total_seconds):
+    '''
+    Formats a time of day in seconds the way the spectrometer's timed
+    sequence does (eg.. 36312.3 to '10h05m12s300').
+    Args:
+        total_seconds: <float> seconds since midnight
+    '''
+    milliseconds = int(round(total_seconds * 1000))
+    hours, milliseconds = divmod(milliseconds, 3600 * 1000)
+    minutes, milliseconds = divmod(milliseconds, 60 * 1000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f'{hours:02d}h{minutes:02d}m{seconds:02d}s{milliseconds:03d}'
+
+
+def spectrum_save(wavelength, intensity, file_path):
+    '''
+    Saves a spectrum as a 2 column (wavelength, intensity) csv, in the same
+    format as the spectrometer.
+    Args:
+        wavelength: <array> wavelength array
+        intensity: <array> intensity array
+        file_path: <string> path to save to
+    '''
+    np.savetxt(file_path,
+               np.vstack((wavelength, intensity)).T,
+               delimiter=',')
+
+
+def experiment_names(number):
+    '''
+    Returns number distinct experiment directory names of the form
+    <concentration>_<solute>_<condition> (eg.. '1M_Salt_Heat').
+    Args:
+        number: <int> number of experiments
+    '''
+    names = []
+    for concentration in concentrations:
+        for solute in solutes:
+            for condition in conditions:
+                names.append(f'{concentration}_{solute}_{condition}')
+    if number > len(names):
+        raise ValueError(f'At most {len(names)} experiments per date')
+    return names[0:number]
+
+
+def make_experiment(exp_dir, spectra, wavelength, rng, day=30,
+                    start=10 * 3600, interval=7.3, drift=(745, 795)):
+    '''
+    Writes the timed sequence spectra of one experiment into exp_dir, named
+    <exp>_<day>_<HH>h<MM>m<SS>s<ms>.csv like the spectrometer's timed
+    sequence. The resonance drifts from drift[0] to drift[1] nm over the
+    experiment with a small random walk, staying inside 740-800 nm, and the
+    time between spectra jitters around interval.
+    Args:
+        exp_dir: <string> experiment directory to create
+        spectra: <int> number of spectra
+        wavelength: <array> wavelength array shared by every spectrum
+        rng: <Generator> numpy random generator
+        day: <int> day of the month in the file names
+        start: <float> time of day of the first spectrum in seconds
+        interval: <float> mean seconds between spectra
+        drift: <array> resonance at the start and end of the experiment
+    '''
+    os.makedirs(exp_dir, exist_ok=True)
+    exp_name = os.path.basename(exp_dir)
+
+    centres = (np.linspace(drift[0], drift[1], spectra)
+               + np.cumsum(rng.normal(0, 0.05, spectra)))
+    centres = np.clip(centres, 740, 800)
+    times = start + np.cumsum(interval + rng.uniform(-0.2, 0.2, spectra))
+    times -= times[0] - start
+
+    for centre, total_seconds in zip(centres, times):
+        spectrum_save(wavelength=wavelength,
+                      intensity=resonance(wavelength, centre, rng),
+                      file_path=os.path.join(
+                          exp_dir,
+                          f'{exp_name}_{day}_{time_string(total_seconds)}'
+                          f'.csv'))
+
+
+def make_dataset(root, dates=1, experiments=2, spectra=100, points=2048,
+                 seed=0):
+    '''
+    Writes a synthetic data set into root/Put_Data_Here with the same
+    directory and file name conventions as real data: a directory per date
+    (eg.. '300519') holding a Background directory with the sensor and
+    solute backgrounds, and the experiment directories of timed sequence
+    spectra. Returns the Put_Data_Here directory path.
+    Args:
+        root: <string> directory to create Put_Data_Here in
+        dates: <int> number of date directories
+        experiments: <int> number of experiments per date
+        spectra: <int> number of spectra per experiment
+        points: <int> number of wavelength points per spectrum
+        seed: <int> random seed, the same seed gives the same data set
+    '''
+    rng = np.random.default_rng(seed)
+    wavelength = np.linspace(500, 1000, points)
+    main_dir = os.path.join(root, 'Put_Data_Here')
+
+    for date_index in range(dates):
+        day = 1 + date_index % 28
+        date_dir = os.path.join(main_dir, f'{day:02d}0519')
+        bg_dir = os.path.join(date_dir, 'Background')
+        os.makedirs(bg_dir, exist_ok=True)
+
+        exp_names = experiment_names(experiments)
+        bg_names = [sensor] + backgrounds + sorted(
+            set('_'.join(a.split('_')[0:2]) for a in exp_names)
+            - set(backgrounds))
+        for bg_name in bg_names:
+            spectrum_save(wavelength=wavelength,
+                          intensity=resonance(wavelength,
+                                              rng.uniform(755, 770),
+                                              rng),
+                          file_path=os.path.join(bg_dir,
+                                                 f'{bg_name}_Background.csv'))
+
+        for exp_name in exp_names:
+            make_experiment(exp_dir=os.path.join(date_dir, exp_name),
+                            spectra=spectra,
+                            wavelength=wavelength,
+                            rng=rng,
+                            day=day)
+    return main_dir
+
+
+if __name__ == '__main__':
+    make_dataset(sys.argv[1], *[int(a) for a in sys.argv[2:6]])
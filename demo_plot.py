@@ -2,6 +2,8 @@ import os
 import numpy as np
 import matplotlib.pyplot as plt
 
+from GMR.Plotting import decimate
+
 
 sensor = 'Nanohole_Array'
 root = os.getcwd()
@@ -40,8 +42,15 @@ bg_file_string = ['1M_Salt_Background',
                   'IPA_Background']
 print(bg_file_string)
 
+x_range = [0, 70]
+
 fig, ax = plt.subplots(1, 1, figsize=[10,7])
-ax.plot(time, peak_shift, 'r.', label=' '.join(label_name))
+ax.plot(*decimate(x=time,
+                  y=peak_shift,
+                  bins=int(ax.bbox.width),
+                  x_range=x_range),
+        'r.',
+        label=' '.join(label_name))
 ax.grid(True)
 ax.legend(frameon=True, loc=0, ncol=1, prop={'size':12})
 
@@ -62,7 +71,7 @@ for index, name in enumerate(names):
                 verticalalignment='center',
                 fontsize=8)
 
-ax.set_xlim(0, 70)
+ax.set_xlim(*x_range)
 ax.set_ylim(18, 20)
 
 ax.set_xlabel('Time [min]', fontsize=14)
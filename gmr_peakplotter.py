@@ -1,255 +1,359 @@
 import os
-import numpy as np
-import matplotlib.pyplot as plt
-import csv
-import shutil
+import sys
+import argparse
 
 import GMR.InputOutput as io
-import GMR.DataPreparation as dprep
 import GMR.DataProcessing as dproc
+import GMR.Pipeline as pipeline
+import GMR.Plotting as plot
+import GMR.Profiling as prof
+import GMR.Scheduler as sched
+import GMR.Watch as watch
 
 sensor = 'Nanohole_Array' ## Set this to the photonic crystal used ##
-
-root = io.config_dir_path()
-
-for date_dir in os.listdir(root):
-    selected_date = os.path.join(root,
-                                 date_dir)
-    print(f'Looking at: {date_dir}')
-
-    print('Background Calibration')
-    bg_dir = os.path.join(selected_date,
-                          'Background')
-    bg_datafiles = io.extract_files(dir_name=bg_dir,
-                                    file_string='_Background.csv')
-
-    for index, selected_file in enumerate(bg_datafiles):
-        file = os.path.join(bg_dir,
-                            selected_file)
-        zero_file = os.path.join(bg_dir,
-                                 f'{sensor}_Background.csv')
-
-        wavelength, intensity, file_name = io.csv_in(file)
-        wav_naught, int_naught, zero_name = io.csv_in(zero_file)
-
-        fig, ax = plt.subplots(1, 1, figsize=[10,7])
-        ax.plot(wavelength, intensity, 'r', lw=2, label=file_name)
-        ax.plot(wav_naught, int_naught, 'b', lw=2, label=zero_name)
-        ax.grid(True)
-        ax.legend(frameon=True, loc=0, ncol=1, prop={'size':12})
-        ax.set_xlabel('Wavelength [nm]', fontsize=14)
-        ax.set_ylabel('Intensity', fontsize=14)
-        ax.set_title(file_name, fontsize=18)
-        ax.tick_params(axis='both', which='major', labelsize=14)
-        fig.tight_layout()
-
-        graph_out_path = os.path.join(bg_dir,
-                                      f'{file_name}.png')
-        plt.savefig(graph_out_path)
-        fig.clf()
-        plt.close(fig)
-
-        file_name, bg_peak, peak_shift = dproc.bg_peaks(file=file,
-                                                        zero_file=zero_file)
-
-        with open('Background_Peaks.csv', 'a', newline='') as outfile:
-            writer = csv.writer(outfile, delimiter='\t')
-            writer.writerow([file_name]
-                            + [bg_peak]
-                            + [peak_shift])
-
-        io.update_progress(index / len(bg_datafiles))
-
-    shutil.copy('Background_Peaks.csv', bg_dir)
-    os.remove('Background_Peaks.csv')
-
-    print(f'\nFiles to be processed: {os.listdir(selected_date)}')
-
-    for exp_dir in os.listdir(selected_date):
-        solute_dir = os.path.join(selected_date,
-                                  exp_dir)
-
-        if 'Background' in exp_dir:
-            print(f'\n{solute_dir} skipped')
-        elif 'Graphs' in exp_dir:
-            print(f'\n{solute_dir} skipped')
-        elif 'Results' in exp_dir:
-            print(f'\n{solute_dir} skipped')
-        elif 'TimeCorrected' in exp_dir:
-            print(f'\n{solute_dir} skipped')
-        elif 'TimeAdjusted' in exp_dir:
-            print(f'\n{solute_dir} skipped')
-
-        else:
-            print('\nCorrecting Time Stamp')
-            dir_params = dprep.solute_finder(solute_dir)
-            dprep.time_sort(in_dir_name=solute_dir,
-                            dir_params=dir_params,
-                            main_dir=selected_date)
-            dir_params = dprep.solute_finder(f'{solute_dir}_TimeAdjusted')
-            dprep.time_correct(in_dir_name=f'{solute_dir}_TimeAdjusted',
-                               dir_params=dir_params,
-                               main_dir=selected_date)
-            shutil.rmtree(f'{solute_dir}_TimeAdjusted')
-
-            print('\nFinding Peaks')
-            timec_dir = f'{solute_dir}_TimeCorrected'
-            results_dir = os.path.join(selected_date,
-                                       'Results')
-            io.check_dir_exists(results_dir)
-
-            dir_params = dprep.solute_finder(timec_dir)
-            data_files = io.extract_files(dir_name=timec_dir,
-                                          file_string='_'.join(dir_params
-                                                               [0:2]))
-
-            zero_file = os.path.join(timec_dir,
-                                     data_files[0])
-
-            outfile_name = (str('_'.join(dir_params[0:-1]))
-                           + '_Peaks.csv')
-            with open(outfile_name, 'a', newline='') as outfile:
-                writer = csv.writer(outfile, delimiter=',')
-                writer.writerow(['Wavelength [nm]']
-                                + ['Peak [nm]']
-                                + ['Peak Shift [nm]'])
-
-                for index, selected_file in enumerate(data_files):
-                    file = os.path.join(timec_dir,
-                                        selected_file)
-                    #zero_file = os.path.join(bg_dir,
-                    #                         f'{sensor}_Background.csv')
-
-#                    wavelength, intensity, file_name = io.array_in(file)
-#
-#                    fig, ax = plt.subplots(1, 1, figsize=[10,7])
-#                    ax.plot(wavelength, intensity, 'b', lw=2, label=file_name)
-#                    ax.grid(True)
-#                    ax.legend(frameon=True, loc=0, ncol=1, prop={'size':12})
-#                    ax.set_xlabel('Wavelength [nm]', fontsize=14)
-#                    ax.set_ylabel('Intensity [au]', fontsize=14)
-#                    ax.set_title(file_name, fontsize=18)
-#                    ax.tick_params(axis='both', which='major', labelsize=14)
-#                    fig.tight_layout()
-#                    ## Uncomment for saving out spectrums ##
-#                    out_dir_name = '_'.join(dir_params[0:-1]) + '_Graphs'
-#                    out_dir = os.path.join(selected_date,
-#                                           out_dir_name)
-#                    io.check_dir_exists(out_dir)
-#                    out_path = os.path.join(out_dir,
-#                                            f'{file_name}.png')
-#                    plt.savefig(out_path)
-#                    fig.clf()
-#                    plt.close(fig)
-
-                    time_stamp, peak, peak_shift = dproc.peak_shift(file,
-                                                                    zero_file)
-                    writer.writerow([time_stamp] + [peak] + [peak_shift])
-                    io.update_progress(index / len(data_files))
-
-            shutil.copy(outfile_name, results_dir)
-            os.remove(outfile_name)
-
-            dir_params = dprep.solute_finder(solute_dir)
-            data_files = io.extract_files(dir_name=results_dir,
-                                          file_string='_'.join(dir_params)
-                                                      + '_Peaks.csv')
-
-            print(f'\nFiles to be processed: {data_files}')
-
-            for index, selected_file in enumerate(data_files):
-                file = os.path.join(results_dir,
-                                    selected_file)
-                file_name = io.get_filename(file)
-
-                bg_file_string = ['1M_Salt_Background',
-                                  '_'.join(dir_params[0:2]) + '_Background',
-                                  '1M_Salt_Paper_Background',
-                                  '_'.join(dir_params[0:2]) + '_Background',
-                                  f'{sensor}_Background',
-                                  'DI_Background',
-                                  'IPA_Background']
-
-                bg_file = os.path.join(bg_dir,
-                                       'Background_Peaks.csv')
-                names, bg_peak, bg_peak_shift = np.genfromtxt(bg_file,
-                                                              delimiter='\t',
-                                                              dtype=(str),
-                                                              unpack=True)
-
-                time, peak, peak_shift = np.genfromtxt(file,
-                                                       delimiter=',',
-                                                       unpack=True)
-                time *= 1/60
-
-                fig, ax = plt.subplots(1, 1, figsize=[10,7])
-                ax.plot(time, peak, 'b.', label=' '.join(file_name.split('_')
-                                                         [0:2]))
-                ax.grid(True)
-                ax.legend(frameon=True, loc=0, ncol=1, prop={'size':12})
-                for index, name in enumerate(names):
-                    if name in bg_file_string:
-                        ax.axhline(y=float(bg_peak[index]),
-                                   linewidth=2,
-                                   color='C' + str(index % 9),
-                                   linestyle=':')
-
-                        ax.text(x=2 * index,
-                                y=(float(bg_peak[index])),
-                                s=' '.join(name.split('_')[0:-1]),
-                                bbox=dict(facecolor='white',
-                                          edgecolor='none',
-                                          alpha=0.5),
-                                horizontalalignment='center',
-                                verticalalignment='center',
-                                fontsize=8)
-
-                ax.set_xlabel('Time [min]', fontsize=14)
-                ax.set_ylabel('Peak [nm]', fontsize=14)
-                ax.set_title(' '.join(file_name.split('_')[0:2]), fontsize=18)
-                ax.tick_params(axis='both', which='major', labelsize=14)
-                fig.tight_layout()
-
-                #plt.show()
-                out_name = f'{file_name}.png'
-                out_path = os.path.join(results_dir,
-                                        out_name)
-                plt.savefig(out_path)
-                fig.clf()
-                plt.close()
-
-                fig, ax = plt.subplots(1, 1, figsize=[10,7])
-                ax.plot(time, peak_shift, 'r.',
-                        label=' '.join(file_name.split('_')[0:2]))
-                ax.grid(True)
-                ax.legend(frameon=True, loc=0, ncol=1, prop={'size':12})
-                for index, name in enumerate(names):
-                    if name in bg_file_string:
-                        ax.axhline(y=float(bg_peak_shift[index]),
-                                   linewidth=2,
-                                   color='C' + str(index % 9),
-                                   linestyle=':')
-
-                        ax.text(x=2 * index,
-                                y=(float(bg_peak_shift[index])),
-                                s=' '.join(name.split('_')[0:-1]),
-                                bbox=dict(facecolor='white',
-                                          edgecolor='none',
-                                          alpha=0.5),
-                                horizontalalignment='center',
-                                verticalalignment='center',
-                                fontsize=8)
-
-                ax.set_xlabel('Time [min]', fontsize=14)
-                ax.set_ylabel('Peak Shift [nm]', fontsize=14)
-                ax.set_title(' '.join(file_name.split('_')[0:2]), fontsize=18)
-                ax.tick_params(axis='both', which='major', labelsize=14)
-                fig.tight_layout()
-
-                #plt.show()
-                out_name = f'{file_name}_Shift.png'
-                out_path = os.path.join(results_dir,
-                                        out_name)
-                plt.savefig(out_path)
-                fig.clf()
-                plt.close()
+save_intermediates = False ## Set True to keep _TimeCorrected spectra ##
+plot_spectra = False ## Set True to save a figure of every spectrum ##
+chunk_size = None ## Set to find peaks this many spectra at a time ##
+
+
+def main(root=None,
+         sensor=sensor,
+         workers=1,
+         render_workers=1,
+         incremental=True,
+         stages=pipeline.stage_names,
+         save_intermediates=save_intermediates,
+         plot_spectra=plot_spectra,
+         interactive=True,
+         profile_file=None,
+         cprofile_experiment=None,
+         roi=None,
+         refinement=None,
+         tracking=None,
+         chunk_size=chunk_size):
+    '''
+    Runs every date directory in Put_Data_Here through the pipeline as a
+    dependency graph of tasks: background calibration per date, then
+    ingest, peak finding and results plotting per experiment. Each task
+    starts as soon as its dependencies are done, across all dates, on a pool
+    of worker processes. Figures are rendered on a separate pool so the
+    numerical work never waits on matplotlib.
+    Args:
+        root: <string> directory containing "Put_Data_Here", defaults to
+              the current working directory
+        sensor: <string> name of the photonic crystal used
+        workers: <int> number of worker processes
+        render_workers: <int> number of figure rendering processes
+        incremental: <bool> only process backgrounds and spectra that are
+                     new or changed since the last run
+        stages: <array> pipeline stages to run, from Pipeline.stage_names
+        save_intermediates: <bool> keep the _TimeCorrected spectra
+        plot_spectra: <bool> save a figure of every spectrum
+        interactive: <bool> wait for the user to confirm the data first
+        profile_file: <string> path to save a json report of the time
+                      spent in each pipeline stage to, None to not profile
+        cprofile_experiment: <string> experiment directory name (or
+                             date/experiment) to run under cProfile, saving
+                             the .prof files next to profile_file (or in
+                             the current directory)
+        roi: <array> [min, max] wavelength (nm) region of interest
+        refinement: <string> peak refinement method, from
+                    DataProcessing.refinement_methods
+        tracking: <bool> track each experiment's peak from spectrum to
+                  spectrum
+        chunk_size: <int> spectra read and searched at once, through a
+                    spectral cube on disk, for experiments too large to
+                    hold in memory, None to hold each experiment in memory
+    '''
+    root = io.config_dir_path(root=root,
+                              interactive=interactive)
+    if profile_file is not None:
+        prof.start(profile_file)
+    set_peak_parameters(roi=roi,
+                        refinement=refinement,
+                        tracking=tracking)
+
+    tasks, manifests = pipeline.pipeline_tasks(
+        root=root,
+        sensor=sensor,
+        save_intermediates=save_intermediates,
+        plot_spectra=plot_spectra,
+        incremental=incremental,
+        stages=stages,
+        chunk_size=chunk_size)
+    if cprofile_experiment is not None:
+        cprofile_tasks(tasks=tasks,
+                       experiment=cprofile_experiment,
+                       out_dir=os.path.dirname(os.path.abspath(
+                           profile_file or 'gmr.prof')))
+
+    initargs = (dict(dproc.peak_parameters),)
+    pools = {}
+    if 'plot' in stages:
+        pools['render'] = plot.start_rendering(
+            workers=render_workers,
+            initializer=pipeline.init_worker,
+            initargs=initargs).pool
+    try:
+        results, errors = sched.run_tasks(tasks=tasks,
+                                          workers=workers,
+                                          pools=pools,
+                                          initializer=pipeline.init_worker,
+                                          initargs=initargs)
+    finally:
+        plot.stop_rendering()
+    pipeline.save_manifests(manifests=manifests,
+                            results=results)
+
+    print('\nProcessed:')
+    for name, result in results.items():
+        if name.startswith('peaks:'):
+            print(f'{name[6:]}: {result["peaks_found"]}/'
+                  f'{result["spectra"]} peaks found')
+    for name, error in errors.items():
+        print(f'{name} failed: {error!r}')
+
+    if profile_file is not None:
+        report = prof.finish(profile_file,
+                             root=root,
+                             workers=workers,
+                             render_workers=render_workers,
+                             stages=list(stages),
+                             tasks=len(results),
+                             failed=len(errors))
+        print(f'\nProfile saved to {profile_file}:')
+        for name, stage in list(report['stages'].items())[:10]:
+            print(f'{name}: {stage["calls"]} calls, '
+                  f'{stage["total"]:.3f} s total, '
+                  f'{stage["p95"] * 1000:.1f} ms 95%')
+
+
+def set_peak_parameters(**parameters):
+    '''
+    Sets DataProcessing.peak_parameters from the command line options
+    before any tasks are made, so they are also recorded in the manifests.
+    Parameters given as None keep the value set in DataProcessing.
+    Args:
+        parameters: peak_parameters names and values, eg.. roi=[700, 850]
+    '''
+    for name, value in parameters.items():
+        if value is not None:
+            dproc.peak_parameters[name] = value
+
+
+def roi_argument(text):
+    '''
+    Parses the --roi option, 'MIN,MAX' in nm, into [min, max].
+    Args:
+        text: <string> option value
+    '''
+    try:
+        roi = [float(a) for a in text.split(',')]
+    except ValueError:
+        roi = []
+    if len(roi) != 2 or roi[0] >= roi[1]:
+        raise argparse.ArgumentTypeError(f'expected MIN,MAX in nm with MIN '
+                                         f'below MAX, not {text!r}')
+    return roi
+
+
+def cprofile_tasks(tasks, experiment, out_dir):
+    '''
+    Runs the process_experiment (ingest and peak finding) task of one
+    experiment under cProfile, dumping its statistics to
+    <experiment>_peaks.prof in out_dir.
+    Args:
+        tasks: <array> Task objects from Pipeline.pipeline_tasks
+        experiment: <string> experiment directory name, or date/experiment
+        out_dir: <string> directory to save the .prof files into
+    '''
+    found = False
+    for task in tasks:
+        stage, _, exp_name = task.name.partition(':')
+        if stage != 'peaks':
+            continue
+        if exp_name != experiment and exp_name.split('/')[-1] != experiment:
+            continue
+        file_name = exp_name.replace('/', '_')
+        task.kwargs = dict(function=task.function,
+                           profile_file=os.path.join(
+                               out_dir,
+                               f'{file_name}_{stage}.prof'),
+                           **task.kwargs)
+        task.function = prof.cprofile_call
+        found = True
+    if not found:
+        print(f'No {experiment} experiment to profile')
+
+
+def watch_experiment(solute_dir,
+                     sensor=sensor,
+                     poll_interval=0.5,
+                     plot_interval=2.0,
+                     idle_timeout=None,
+                     overwrite=False,
+                     roi=None,
+                     refinement=None):
+    '''
+    Follows a single experiment directory while spectra are still being
+    written into it, appending each new peak to the results and refreshing
+    the figures as they arrive. Stops on Ctrl+C or after idle_timeout
+    seconds without a new spectrum, then prints the latency report.
+    Args:
+        solute_dir: <string> path to experiment directory
+        sensor: <string> name of the photonic crystal used
+        poll_interval: <float> seconds between directory polls
+        plot_interval: <float> minimum seconds between figure refreshes
+        idle_timeout: <float> seconds without new spectra before stopping
+        overwrite: <bool> replace the experiment's existing results file
+        roi: <array> [min, max] wavelength (nm) region of interest
+        refinement: <string> peak refinement method, from
+                    DataProcessing.refinement_methods
+    '''
+    set_peak_parameters(roi=roi,
+                        refinement=refinement)
+    solute_dir = os.path.abspath(solute_dir)
+    watcher = watch.ExperimentWatcher(
+        solute_dir=solute_dir,
+        bg_dir=pipeline.background_dir(os.path.dirname(solute_dir)),
+        sensor=sensor,
+        poll_interval=poll_interval,
+        plot_interval=plot_interval,
+        overwrite=overwrite)
+    report = watcher.run(idle_timeout=idle_timeout)
+
+    print(f'\n{report["spectra"]} spectra plotted')
+    if report['spectra'] > 0:
+        print(f'Latency mean {report["mean"]:.2f} s, '
+              f'95% {report["p95"]:.2f} s, '
+              f'max {report["max"]:.2f} s')
+    for file_name, error in watcher.bad_files:
+        print(f'{file_name} failed: {error!r}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Find and plot GMR resonant peaks with respect to time')
+    parser.add_argument('--root',
+                        default=None,
+                        help='directory containing Put_Data_Here, defaults '
+                             'to the current directory')
+    parser.add_argument('--sensor',
+                        default=sensor,
+                        help='photonic crystal used for the backgrounds')
+    parser.add_argument('--workers',
+                        type=int,
+                        default=1,
+                        help='number of worker processes')
+    parser.add_argument('--render-workers',
+                        type=int,
+                        default=1,
+                        help='number of figure rendering processes')
+    parser.add_argument('--full',
+                        action='store_true',
+                        help='reprocess everything, ignoring the manifests')
+    parser.add_argument('--stages',
+                        default=','.join(pipeline.stage_names),
+                        help='comma separated stages to run, from '
+                             f'{",".join(pipeline.stage_names)}')
+    parser.add_argument('--save-intermediates',
+                        action='store_true',
+                        default=save_intermediates,
+                        help='keep the _TimeCorrected spectra')
+    parser.add_argument('--plot-spectra',
+                        action='store_true',
+                        default=plot_spectra,
+                        help='save a figure of every spectrum')
+    parser.add_argument('--chunk-size',
+                        type=int,
+                        default=chunk_size,
+                        metavar='SPECTRA',
+                        help='find peaks this many spectra at a time, '
+                             'through a spectral cube on disk, for '
+                             'experiments too large to hold in memory')
+    parser.add_argument('--batch',
+                        action='store_true',
+                        help='never prompt, for running from cron or a job '
+                             'scheduler')
+    parser.add_argument('--profile',
+                        metavar='REPORT_FILE',
+                        help='save a json report of the time and bytes read '
+                             'and written in each pipeline stage')
+    parser.add_argument('--cprofile',
+                        metavar='EXPERIMENT',
+                        help='run one experiment (directory name or '
+                             'date/experiment) under cProfile, saving .prof '
+                             'files next to the report')
+    parser.add_argument('--roi',
+                        type=roi_argument,
+                        metavar='MIN,MAX',
+                        help='only keep this wavelength range (nm) of every '
+                             'spectrum')
+    parser.add_argument('--refinement',
+                        choices=dproc.refinement_methods,
+                        help='refine peaks to sub-sample precision with '
+                             'this method')
+    parser.add_argument('--tracking',
+                        action='store_true',
+                        default=None,
+                        help='search for each peak near the peak of the '
+                             'previous spectrum')
+    parser.add_argument('--watch',
+                        metavar='EXPERIMENT_DIR',
+                        help='follow an experiment directory while it is '
+                             'being written to')
+    parser.add_argument('--poll-interval',
+                        type=float,
+                        default=0.5,
+                        help='seconds between polls in watch mode')
+    parser.add_argument('--plot-interval',
+                        type=float,
+                        default=2.0,
+                        help='minimum seconds between figure refreshes in '
+                             'watch mode')
+    parser.add_argument('--idle-timeout',
+                        type=float,
+                        default=None,
+                        help='stop watching after this many seconds without '
+                             'a new spectrum')
+    parser.add_argument('--overwrite',
+                        action='store_true',
+                        help='in watch mode, replace the results of an '
+                             'experiment that already has them')
+    args = parser.parse_args()
+    stages = [a for a in args.stages.split(',') if a]
+    unknown = set(stages) - set(pipeline.stage_names)
+    if unknown:
+        parser.error(f'unknown stage(s) {",".join(sorted(unknown))}')
+
+    if args.watch:
+        try:
+            watch_experiment(solute_dir=args.watch,
+                             sensor=args.sensor,
+                             poll_interval=args.poll_interval,
+                             plot_interval=args.plot_interval,
+                             idle_timeout=args.idle_timeout,
+                             overwrite=args.overwrite,
+                             roi=args.roi,
+                             refinement=args.refinement)
+        except FileExistsError as error:
+            sys.exit(str(error))
+    else:
+        try:
+            main(root=args.root,
+                 sensor=args.sensor,
+                 workers=args.workers,
+                 render_workers=args.render_workers,
+                 incremental=not args.full,
+                 stages=stages,
+                 save_intermediates=args.save_intermediates,
+                 plot_spectra=args.plot_spectra,
+                 interactive=not args.batch and sys.stdin.isatty(),
+                 profile_file=args.profile,
+                 cprofile_experiment=args.cprofile,
+                 roi=args.roi,
+                 refinement=args.refinement,
+                 tracking=args.tracking,
+                 chunk_size=args.chunk_size)
+        except FileNotFoundError as error:
+            sys.exit(str(error))